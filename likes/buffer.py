@@ -0,0 +1,212 @@
+"""
+Write-behind buffer for likes.
+
+Liking or unliking only records the wanted state per (user, object) in
+memory and appends it to a journal file, so repeated toggles of the same
+object by the same user collapse into one entry. A flush applies the
+buffer with one bulk insert, one bulk delete and one counter update per
+distinct delta, once MAX_PENDING entries are waiting or every
+FLUSH_INTERVAL seconds.
+
+Each process appends to its own journal and holds an exclusive lock on it
+until the entries are applied. A journal whose lock is free was left by a
+process that stopped before flushing; the next flush in any process (or
+the flush_likes command) replays it together with the current buffer.
+Entries are timestamped and the newest state per (user, object) wins,
+so an old journal never undoes a later like or unlike. Entries record a
+state, not a toggle, so replaying a journal that was already partly
+applied is harmless.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from uuid import uuid4
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from .models import LikeCount, LikedItem
+from .signals import batch_counting
+
+_buffer_settings = getattr(settings, 'LIKES_BUFFER', {})
+DIRECTORY = _buffer_settings.get('DIRECTORY', Path(settings.BASE_DIR) / 'var' / 'likes')
+MAX_PENDING = _buffer_settings.get('MAX_PENDING', 1000)
+FLUSH_INTERVAL = _buffer_settings.get('FLUSH_INTERVAL', 2)
+
+logger = logging.getLogger(__name__)
+
+
+def apply(states):
+    """
+    Applies {(user_id, content_type_id, object_id): liked} to LikedItem and
+    LikeCount in one transaction. Returns the (created, deleted) counts.
+    """
+    if not states:
+        return 0, 0
+    user_ids = {user_id for user_id, content_type_id, object_id in states}
+    object_ids = {object_id for user_id, content_type_id, object_id in states}
+
+    with transaction.atomic():
+        # Flushes of the same objects in other processes wait here, so the
+        # rows read below are exactly what the writes change and the counter
+        # deltas are exact. The locking read sees their committed rows.
+        LikeCount.objects.lock({(content_type_id, object_id) for user_id, content_type_id, object_id in states})
+        existing = {(user_id, content_type_id, object_id): pk for pk, user_id, content_type_id, object_id in
+                    LikedItem.objects.select_for_update()
+                    .filter(user_id__in=user_ids, object_id__in=object_ids)
+                    .values_list('pk', 'user_id', 'content_type_id', 'object_id')}
+        # Likes of users deleted since they were buffered are dropped.
+        live_users = set(get_user_model().objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+        created = [key for key, liked in states.items() if liked and key not in existing and key[0] in live_users]
+        deleted = [key for key, liked in states.items() if not liked and key in existing]
+
+        token = batch_counting.set(True)
+        try:
+            LikedItem.objects.bulk_create(
+                [LikedItem(user_id=user_id, content_type_id=content_type_id, object_id=object_id)
+                 for user_id, content_type_id, object_id in created],
+                ignore_conflicts=True)
+            LikedItem.objects.filter(pk__in=[existing[key] for key in deleted]).delete()
+        finally:
+            batch_counting.reset(token)
+
+        deltas = Counter()
+        for user_id, content_type_id, object_id in created:
+            deltas[content_type_id, object_id] += 1
+        for user_id, content_type_id, object_id in deleted:
+            deltas[content_type_id, object_id] -= 1
+        LikeCount.objects.adjust(deltas)
+    return len(created), len(deleted)
+
+
+def read_journal(journal, states):
+    """Merges the entries of `journal` into {key: (written_at, liked)}, keeping the newest per key."""
+    journal.seek(0)
+    for line in journal:
+        try:
+            user_id, content_type_id, object_id, liked, written_at = json.loads(line)
+        except ValueError:
+            # A line cut short when the process stopped mid-write.
+            continue
+        key = user_id, content_type_id, object_id
+        if key not in states or written_at >= states[key][0]:
+            states[key] = written_at, liked
+    return states
+
+
+class LikeBuffer:
+    def __init__(self, directory=DIRECTORY, max_pending=MAX_PENDING, flush_interval=FLUSH_INTERVAL):
+        self.directory = Path(directory)
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.journal = None
+        self.journal_path = None
+        self.flushes = 0
+        self.recovered = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def set(self, user_id, content_type_id, object_id, liked):
+        """Buffers a like (liked=True) or unlike of an object by a user."""
+        with self._lock:
+            if self.journal is None:
+                self._open_journal()
+            self.journal.write(json.dumps([user_id, content_type_id, object_id, liked, time.time_ns()]) + '\n')
+            self.journal.flush()
+            self.pending[user_id, content_type_id, object_id] = liked
+            full = len(self.pending) >= self.max_pending
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Applies the buffered entries together with the journals left by
+        failed flushes and stopped processes. Entries carry the time they
+        were written, so the latest state of each (user, object) wins
+        whichever journal it is in.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self.pending = self.pending, {}
+                journal, self.journal = self.journal, None
+                journal_path = self.journal_path
+            journals = self._lock_abandoned_journals()
+            recovered = len(journals)
+            if journal is not None:
+                journals.append((journal_path, journal))
+            try:
+                states = {}
+                for path, file in journals:
+                    read_journal(file, states)
+                apply({key: liked for key, (written_at, liked) in states.items()})
+                for path, file in journals:
+                    path.unlink(missing_ok=True)
+            finally:
+                # Releases the locks; journals that were not applied are
+                # picked up by the next flush.
+                for path, file in journals:
+                    file.close()
+            self.recovered += recovered
+            if pending:
+                self.flushes += 1
+
+    def close(self):
+        if self.journal is not None:
+            self.flush()
+
+    def stats(self):
+        return {
+            'pending': len(self.pending),
+            'flushes': self.flushes,
+            'recovered_journals': self.recovered,
+        }
+
+    def _lock_abandoned_journals(self):
+        """Locks and opens the journals that no running process holds."""
+        if not self.directory.exists():
+            return []
+        journals = []
+        for path in self.directory.glob('*.journal'):
+            try:
+                file = open(path)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Still being written by a running process.
+                file.close()
+                continue
+            journals.append((path, file))
+        return journals
+
+    def _open_journal(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.journal_path = self.directory / f'{uuid4().hex}.journal'
+        self.journal = open(self.journal_path, 'a+')
+        fcntl.flock(self.journal, fcntl.LOCK_EX)
+        if self._timer is None and self.flush_interval:
+            self._timer = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._timer.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            # Also runs with nothing pending, to replay abandoned journals.
+            try:
+                self.flush()
+            except Exception:
+                # The journal stays on disk and is replayed by the next flush.
+                logger.exception('Flushing buffered likes failed.')
+            finally:
+                connection.close()
+
+
+like_buffer = LikeBuffer()
+atexit.register(like_buffer.close)
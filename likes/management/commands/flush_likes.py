@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from likes.buffer import like_buffer
+
+
+class Command(BaseCommand):
+    help = 'Applies the like journals left by stopped processes (see likes.buffer).'
+
+    def handle(self, *args, **options):
+        like_buffer.flush()
+        self.stdout.write(self.style.SUCCESS(f'Replayed {like_buffer.recovered} like journals.'))
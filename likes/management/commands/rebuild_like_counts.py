@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from likes.models import LikeCount, LikedItem
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the LikeCount counters from the liked item table.'
+
+    def handle(self, *args, **options):
+        counts = LikedItem.objects.order_by().values('content_type', 'object_id').annotate(count=Count('id'))
+        with transaction.atomic():
+            LikeCount.objects.all().delete()
+            LikeCount.objects.bulk_create(
+                (LikeCount(content_type_id=row['content_type'], object_id=row['object_id'], count=row['count'])
+                 for row in counts.iterator(chunk_size=10000)),
+                batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt like counts for {LikeCount.objects.count()} objects.'))
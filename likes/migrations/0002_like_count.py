@@ -0,0 +1,60 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    duplicates = LikedItem.objects.order_by().values('user', 'content_type', 'object_id') \
+        .annotate(first=Min('id'), count=Count('id')).filter(count__gt=1)
+    for row in duplicates:
+        LikedItem.objects.filter(user=row['user'], content_type=row['content_type'], object_id=row['object_id']) \
+            .exclude(pk=row['first']).delete()
+
+
+def populate_like_counts(apps, schema_editor):
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    LikeCount = apps.get_model('likes', 'LikeCount')
+    counts = LikedItem.objects.order_by().values('content_type', 'object_id').annotate(count=Count('id'))
+    LikeCount.objects.bulk_create(
+        (LikeCount(content_type_id=row['content_type'], object_id=row['object_id'], count=row['count'])
+         for row in counts.iterator(chunk_size=10000)),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('likes', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LikeCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(remove_duplicate_likes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='likeditem',
+            constraint=models.UniqueConstraint(fields=('user', 'content_type', 'object_id'), name='unique_liked_item'),
+        ),
+        migrations.AddField(
+            model_name='likecount',
+            name='content_type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype'),
+        ),
+        migrations.AddConstraint(
+            model_name='likecount',
+            constraint=models.UniqueConstraint(fields=('content_type', 'object_id'), name='unique_like_count'),
+        ),
+        migrations.RunPython(populate_like_counts, migrations.RunPython.noop),
+    ]
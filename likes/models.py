@@ -1,12 +1,97 @@
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
 
+class LikedItemManager(models.Manager):
+    def liked_by(self, user, obj_type, obj_ids):
+        """Returns the ids in `obj_ids` that `user` has liked, with one query."""
+        if not user.is_authenticated or not obj_ids:
+            return set()
+        content_type = ContentType.objects.get_for_model(obj_type)
+        return set(self.filter(user=user, content_type=content_type, object_id__in=obj_ids)
+                   .values_list('object_id', flat=True))
+
+
 class LikedItem(models.Model):
+    objects = LikedItemManager()
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'content_type', 'object_id'], name='unique_liked_item'),
+        ]
+
+
+class LikeCountManager(models.Manager):
+    def counts_for(self, obj_type, obj_ids):
+        """Returns {object_id: like count} for every id in `obj_ids` with one query."""
+        counts = {obj_id: 0 for obj_id in obj_ids}
+        if not counts:
+            return counts
+        content_type = ContentType.objects.get_for_model(obj_type)
+        counts.update(self.filter(content_type=content_type, object_id__in=counts)
+                      .values_list('object_id', 'count'))
+        return counts
+
+    def lock(self, keys):
+        """
+        Creates the missing counters of {(content_type_id, object_id)} and
+        locks them until the end of the transaction. Rows are locked in id
+        order, so concurrent callers wait for each other instead of
+        deadlocking.
+        """
+        object_ids = {}
+        for content_type_id, object_id in keys:
+            object_ids.setdefault(content_type_id, []).append(object_id)
+        if not object_ids:
+            return
+        self.bulk_create([LikeCount(content_type_id=content_type_id, object_id=object_id)
+                          for content_type_id, object_id in keys], ignore_conflicts=True)
+        condition = Q()
+        for content_type_id, ids in object_ids.items():
+            condition |= Q(content_type_id=content_type_id, object_id__in=ids)
+        list(self.select_for_update().filter(condition).order_by('pk').values_list('pk', flat=True))
+
+    def adjust(self, deltas):
+        """
+        Adds {(content_type_id, object_id): delta} to the counters, creating
+        the missing rows. Counters with the same delta are updated together.
+        """
+        by_delta = {}
+        for (content_type_id, object_id), delta in deltas.items():
+            if delta:
+                by_delta.setdefault(delta, {}).setdefault(content_type_id, []).append(object_id)
+        if not by_delta:
+            return
+        with transaction.atomic(using=self.db):
+            self.bulk_create([LikeCount(content_type_id=content_type_id, object_id=object_id)
+                              for content_type_id, object_id in deltas], ignore_conflicts=True)
+            for delta, objects in by_delta.items():
+                for content_type_id, object_ids in objects.items():
+                    self.filter(content_type_id=content_type_id, object_id__in=object_ids) \
+                        .update(count=Greatest(F('count') + delta, 0))
+
+
+class LikeCount(models.Model):
+    """
+    The number of LikedItem rows per liked object, kept up to date by
+    likes.signals. Rebuild it with the rebuild_like_counts command after
+    bulk loads.
+    """
+    objects = LikeCountManager()
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id'], name='unique_like_count'),
+        ]
@@ -0,0 +1,20 @@
+from contextvars import ContextVar
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import LikeCount, LikedItem
+
+# Set while likes.buffer applies a batch and adjusts the counters itself.
+batch_counting = ContextVar('batch_counting', default=False)
+
+
+@receiver(post_save, sender=LikedItem)
+def count_like(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and not batch_counting.get():
+        LikeCount.objects.adjust({(instance.content_type_id, instance.object_id): 1})
+
+
+@receiver(post_delete, sender=LikedItem)
+def count_unlike(sender, instance, **kwargs):
+    if batch_counting.get():
+        return
+    LikeCount.objects.adjust({(instance.content_type_id, instance.object_id): -1})
@@ -1,3 +1,105 @@
-from django.test import TestCase
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Barrier, Thread
+from unittest import skipIf
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from .buffer import LikeBuffer, apply
+from .models import LikeCount, LikedItem
 
-# Create your tests here.
+
+class LikeBufferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create(username=f'user{n}', email=f'user{n}@example.com') for n in range(3)]
+        # Any model will do as the liked object.
+        cls.content_type = ContentType.objects.get_for_model(User)
+        cls.liked = cls.users[0].id
+
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.buffer = LikeBuffer(directory=self.directory, flush_interval=None)
+
+    def write_journal(self, *entries):
+        """Leaves a journal behind as a process that stopped before flushing would."""
+        path = self.directory / f'{len(list(self.directory.glob("*.journal")))}.journal'
+        path.write_text(''.join(json.dumps(entry) + '\n' for entry in entries))
+        return path
+
+    def entry(self, user, liked, written_at):
+        return [user.id, self.content_type.id, self.liked, liked, written_at]
+
+    def count(self):
+        return LikeCount.objects.filter(content_type=self.content_type, object_id=self.liked) \
+            .values_list('count', flat=True).first()
+
+    def liked_by(self):
+        return set(LikedItem.objects.filter(content_type=self.content_type, object_id=self.liked)
+                   .values_list('user_id', flat=True))
+
+    def test_flush_applies_the_latest_state(self):
+        self.buffer.set(self.users[0].id, self.content_type.id, self.liked, True)
+        self.buffer.set(self.users[1].id, self.content_type.id, self.liked, True)
+        self.buffer.set(self.users[1].id, self.content_type.id, self.liked, False)
+        self.assertEqual(self.buffer.stats()['pending'], 2)
+        self.buffer.flush()
+        self.assertEqual(self.liked_by(), {self.users[0].id})
+        self.assertEqual(self.count(), 1)
+        self.assertEqual(list(self.directory.glob('*.journal')), [])
+
+    def test_abandoned_journals_are_replayed(self):
+        path = self.write_journal(self.entry(self.users[0], True, 1), self.entry(self.users[1], True, 2))
+        # A line cut short by the stop is skipped.
+        with open(path, 'a') as journal:
+            journal.write('[1, 2')
+        self.buffer.flush()
+        self.assertEqual(self.liked_by(), {self.users[0].id, self.users[1].id})
+        self.assertEqual(self.count(), 2)
+        self.assertEqual(self.buffer.stats()['recovered_journals'], 1)
+        self.assertFalse(path.exists())
+
+    def test_newest_state_wins_across_journals(self):
+        self.write_journal(self.entry(self.users[0], False, 5), self.entry(self.users[1], True, 1))
+        self.write_journal(self.entry(self.users[0], True, 3), self.entry(self.users[1], False, 4))
+        self.buffer.flush()
+        self.assertEqual(self.liked_by(), set())
+        self.assertEqual(self.count(), 0)
+
+    def test_replaying_applied_entries_is_harmless(self):
+        apply({(self.users[0].id, self.content_type.id, self.liked): True})
+        self.write_journal(self.entry(self.users[0], True, 1), self.entry(self.users[2], False, 1))
+        self.buffer.flush()
+        self.assertEqual(self.liked_by(), {self.users[0].id})
+        self.assertEqual(self.count(), 1)
+
+
+class ConcurrentApplyTests(TransactionTestCase):
+    @skipIf(connection.vendor == 'sqlite', 'SQLite runs one writer at a time.')
+    def test_overlapping_flushes_keep_counts_exact(self):
+        User = get_user_model()
+        users = [User.objects.create(username=f'user{n}', email=f'user{n}@example.com') for n in range(20)]
+        content_type = ContentType.objects.get_for_model(User)
+        states = {(user.id, content_type.id, users[0].id): True for user in users}
+        threads = 4
+        barrier = Barrier(threads)
+
+        def flush():
+            barrier.wait()
+            try:
+                apply(states)
+            finally:
+                connection.close()
+
+        workers = [Thread(target=flush) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(LikedItem.objects.count(), len(users))
+        self.assertEqual(LikeCount.objects.get(object_id=users[0].id).count, len(users))
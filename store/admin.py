@@ -1,9 +1,10 @@
 from django.contrib import admin, messages
-from django.db.models.aggregates import Count
+from django.db.models.functions import Coalesce
 from django.db.models.query import QuerySet
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
-from . import models
+from . import inventory, models
+from .inventory import available_inventory
 
 
 class InventoryFilter(admin.SimpleListFilter):
@@ -17,7 +18,7 @@ class InventoryFilter(admin.SimpleListFilter):
 
     def queryset(self, request, queryset: QuerySet):
         if self.value() == '<10':
-            return queryset.filter(inventory__lt=10)
+            return queryset.filter(available_inventory__lt=10)
 
 
 @admin.register(models.Product)
@@ -38,15 +39,20 @@ class ProductAdmin(admin.ModelAdmin):
     def collection_title(self, product):
         return product.collection.title
 
-    @admin.display(ordering='inventory')
+    @admin.display(ordering='available_inventory')
     def inventory_status(self, product):
-        if product.inventory < 10:
+        if product.available_inventory < 10:
             return 'Low'
         return 'OK'
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            available_inventory=available_inventory()
+        )
+
     @admin.action(description='Clear inventory')
     def clear_inventory(self, request, queryset):
-        updated_count = queryset.update(inventory=0)
+        updated_count = inventory.clear(queryset.values_list('pk', flat=True))
         self.message_user(
             request,
             f'{updated_count} products were successfully updated.',
@@ -60,7 +66,7 @@ class CollectionAdmin(admin.ModelAdmin):
     list_display = ['title', 'products_count']
     search_fields = ['title']
 
-    @admin.display(ordering='products_count')
+    @admin.display(ordering='product_count')
     def products_count(self, collection):
         url = (
             reverse('admin:store_product_changelist')
@@ -68,12 +74,7 @@ class CollectionAdmin(admin.ModelAdmin):
             + urlencode({
                 'collection__id': str(collection.id)
             }))
-        return format_html('<a href="{}">{} Products</a>', url, collection.products_count)
-
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            products_count=Count('product')
-        )
+        return format_html('<a href="{}">{} Products</a>', url, collection.product_count)
 
 
 @admin.register(models.Customer)
@@ -96,8 +97,9 @@ class CustomerAdmin(admin.ModelAdmin):
         return format_html('<a href="{}">{} Orders</a>', url, customer.orders_count)
 
     def get_queryset(self, request):
+        # Read from CustomerOrderStats instead of counting the order table.
         return super().get_queryset(request).annotate(
-            orders_count=Count('order')
+            orders_count=Coalesce('order_stats__order_count', 0)
         )
 
 
@@ -122,6 +124,14 @@ class CartItemInline(admin.StackedInline):
     min_num = 1
     extra = 0
 
+@admin.register(models.InventoryShard)
+class InventoryShardAdmin(admin.ModelAdmin):
+    autocomplete_fields = ['product']
+    list_display = ['product', 'shard', 'quantity']
+    list_select_related = ['product']
+    ordering = ['product', 'shard']
+
+
 @admin.register(models.Cart)
 class CartAdmin(admin.ModelAdmin):
     list_display = ['id', 'created_at']
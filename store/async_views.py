@@ -0,0 +1,138 @@
+"""
+Async variants of the catalog and cart read endpoints, for ASGI deployments.
+
+They borrow the queryset, filter backends, pagination and serializers of
+the matching viewset but run as coroutines, so under ASGI the view itself
+doesn't hop to the sync thread pool, and they query through Django's async
+ORM methods. Responses are always JSON and match the sync endpoints.
+"""
+from asgiref.sync import sync_to_async
+from django.core.exceptions import SynchronousOnlyOperation, ValidationError
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.renderers import JSONRenderer
+from .cache import aget_catalog_version, response_cache
+from .routers import read_from_primary
+from .serializers import CartSerializer, CollectionSerializer, ProductListSerializer
+from .views import CartViewSet, CollectionViewSet, ProductViewSet
+
+renderer = JSONRenderer()
+
+
+def render(data, status=200, headers=None):
+    return HttpResponse(renderer.render(data), status=status, content_type='application/json', headers=headers)
+
+
+def render_exception(exc):
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return render(data, status=exc.status_code)
+
+
+def get_view(viewset, request, action, **kwargs):
+    view = viewset(action_map={'get': action}, args=(), kwargs=kwargs, format_kwarg=None)
+    view.request = view.initialize_request(request)
+    return view
+
+
+async def afilter_queryset(view, queryset):
+    # Filter backends only build the query, so they run in the event loop.
+    for backend in view.filter_backends:
+        try:
+            queryset = backend().filter_queryset(view.request, queryset, view)
+        except SynchronousOnlyOperation:
+            # The in-memory search backend loads its index on first use.
+            queryset = await sync_to_async(backend().filter_queryset)(view.request, queryset, view)
+    return queryset
+
+
+async def apaginate_queryset(view, queryset):
+    paginator = view.paginator
+    if paginator is None:
+        return None
+    if hasattr(paginator, 'apaginate_queryset'):
+        return await paginator.apaginate_queryset(queryset, view.request, view)
+    return await sync_to_async(paginator.paginate_queryset)(queryset, view.request, view)
+
+
+async def cached(request, build, cacheable=True):
+    # Shares response_cache and its catalog versioning with CatalogCacheMixin.
+    key = (await aget_catalog_version(), request.build_absolute_uri()) if cacheable else None
+    if key is not None:
+        data = response_cache.get(key)
+        if data is not None:
+            return render(data, headers={'X-Cache': 'HIT'})
+        # As in CatalogCacheMixin, what gets cached is read from the primary.
+        read_from_primary()
+    try:
+        data = await build()
+    except APIException as exc:
+        return render_exception(exc)
+    if key is None:
+        return render(data)
+    response_cache.set(key, data)
+    return render(data, headers={'X-Cache': 'MISS'})
+
+
+async def serialize_products(rows, context):
+    serializer = ProductListSerializer(rows, context)
+    if not (context['include_tags'] or context['include_likes']):
+        return serializer.data
+    # The opt-in fields are loaded with the sync ORM, and likes need the user.
+    return await sync_to_async(lambda: serializer.data)()
+
+
+async def product_list(request):
+    view = get_view(ProductViewSet, request, 'list')
+    context = view.get_serializer_context()
+
+    async def build():
+        queryset = await afilter_queryset(view, view.get_queryset())
+        queryset = queryset.values(*ProductListSerializer.value_fields)
+        page = await apaginate_queryset(view, queryset)
+        if page is None:
+            return await serialize_products([row async for row in queryset], context)
+        return view.get_paginated_response(await serialize_products(page, context)).data
+
+    # Likes are per user, as in ProductViewSet.get_cache_key().
+    return await cached(request, build, cacheable=not context['include_likes'])
+
+
+async def product_detail(request, pk):
+    view = get_view(ProductViewSet, request, 'retrieve', pk=pk)
+    context = view.get_serializer_context()
+
+    async def build():
+        try:
+            row = await view.get_queryset().filter(pk=pk).values(*ProductListSerializer.value_fields).afirst()
+        except (TypeError, ValueError):
+            raise NotFound()
+        if row is None:
+            raise NotFound('No Product matches the given query.')
+        return (await serialize_products([row], context))[0]
+
+    return await cached(request, build, cacheable=not context['include_likes'])
+
+
+async def collection_list(request):
+    view = get_view(CollectionViewSet, request, 'list')
+
+    async def build():
+        queryset = await afilter_queryset(view, view.get_queryset())
+        page = await apaginate_queryset(view, queryset)
+        if page is None:
+            return CollectionSerializer([collection async for collection in queryset], many=True).data
+        return view.get_paginated_response(CollectionSerializer(page, many=True).data).data
+
+    return await cached(request, build)
+
+
+async def cart_detail(request, pk):
+    view = get_view(CartViewSet, request, 'retrieve', pk=pk)
+    try:
+        # The items are prefetched as part of the async fetch.
+        cart = await view.get_queryset().filter(pk=pk).afirst()
+    except ValidationError:
+        return render_exception(NotFound())
+    if cart is None:
+        return render_exception(NotFound('No Cart matches the given query.'))
+    return render(CartSerializer(cart).data)
@@ -1,6 +1,47 @@
 # authentication.py
-from rest_framework_simplejwt.authentication import JWTAuthentication
+import copy
+from functools import partial
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from .cache import LRUCache
+
+USER_VERSION_KEY = 'store:user_version:{}'
+
+_user_cache_settings = getattr(settings, 'JWT_USER_CACHE', {})
+# Active users by (id, version). The version lives in the shared cache and
+# is bumped from the user save/delete signals in store.signals, so a user
+# saved in any worker is reloaded by all of them. user_cache.stats()
+# reports how many lookups it saved.
+user_cache = LRUCache(
+    max_entries=_user_cache_settings.get('MAX_ENTRIES', 10000),
+    timeout=_user_cache_settings.get('TIMEOUT', 60))
+
+
+def get_user_version(user_id):
+    return cache.get_or_set(USER_VERSION_KEY.format(user_id), 1, timeout=None)
+
+
+def bump_user_version(user_id):
+    """
+    Moves the version of a user forward once the current transaction
+    commits, so no request can cache the row being replaced under the new
+    version (see store.cache.bump_catalog_version).
+    """
+    transaction.on_commit(partial(_bump_user_version, USER_VERSION_KEY.format(user_id)))
+
+
+def _bump_user_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, timeout=None)
+
 
 class JWTCookieAuthentication(JWTAuthentication):
     """
@@ -18,4 +59,29 @@ class JWTCookieAuthentication(JWTAuthentication):
         validated_token = self.get_validated_token(raw_token)
         user = self.get_user(validated_token)
         
-        return (user, validated_token)
\ No newline at end of file
+        return (user, validated_token)
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        # Tokens may carry the id as a string; the signals bump by str(pk).
+        user_id = str(user_id)
+        key = (user_id, get_user_version(user_id))
+        user = user_cache.get(key)
+        if user is None:
+            # Raises for unknown, inactive and revoked users, none of which
+            # are cached.
+            user = super().get_user(validated_token)
+            user_cache.set(key, copy.copy(user))
+            return user
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        # Each request gets its own copy, so per-request state such as the
+        # permission cache never leaks between requests.
+        return copy.copy(user)
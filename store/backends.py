@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+from .cache import LRUCache
+
+PERMISSION_VERSION_KEY = 'store:permission_version'
+
+_permission_cache_settings = getattr(settings, 'PERMISSION_CACHE', {})
+permission_cache = LRUCache(
+    max_entries=_permission_cache_settings.get('MAX_ENTRIES', 10000),
+    timeout=_permission_cache_settings.get('TIMEOUT', 300))
+
+
+def get_permission_version():
+    return cache.get_or_set(PERMISSION_VERSION_KEY, 1, timeout=None)
+
+
+def bump_permission_version():
+    """
+    Moves the permission version forward once the current transaction
+    commits (see store.cache.bump_catalog_version).
+    """
+    transaction.on_commit(_bump_permission_version)
+
+
+def _bump_permission_version():
+    try:
+        cache.incr(PERMISSION_VERSION_KEY)
+    except ValueError:
+        cache.set(PERMISSION_VERSION_KEY, 2, timeout=None)
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that shares each user's permission set across requests.
+    Entries are keyed by a permission version that moves forward whenever
+    group or permission membership changes (see store.signals), and by the
+    user's superuser flag, so has_perm() costs no queries once warm.
+    """
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            key = (get_permission_version(), user_obj.pk, user_obj.is_superuser)
+            perms = permission_cache.get(key)
+            if perms is None:
+                perms = frozenset(super().get_all_permissions(user_obj))
+                permission_cache.set(key, perms)
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
@@ -0,0 +1,195 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+from .routers import read_from_primary
+
+CATALOG_VERSION_KEY = 'store:catalog_version'
+CATALOG_MODIFIED_KEY = 'store:catalog_modified'
+
+
+class LRUCache:
+    """
+    A thread-safe in-process cache with LRU eviction and a per-entry TTL.
+    """
+    def __init__(self, max_entries=1000, timeout=60):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        expires_at = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def get_catalog_version():
+    return cache.get_or_set(CATALOG_VERSION_KEY, 1, timeout=None)
+
+
+async def aget_catalog_version():
+    return await cache.aget_or_set(CATALOG_VERSION_KEY, 1, timeout=None)
+
+
+def bump_catalog_version():
+    """
+    Moves the catalog version forward once the current transaction commits.
+    Bumping earlier would let a concurrent request cache the rows that are
+    still committed under the new version.
+    """
+    transaction.on_commit(_bump_catalog_version)
+
+
+def _bump_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, 2, timeout=None)
+    # Set after the version, so a response built from the new version is
+    # never labelled with the previous modification time.
+    cache.set(CATALOG_MODIFIED_KEY, time.time(), timeout=None)
+
+
+def get_catalog_modified():
+    """The time of the last catalog change, or now if it is not known."""
+    return cache.get_or_set(CATALOG_MODIFIED_KEY, time.time, timeout=None)
+
+
+_response_cache_settings = getattr(settings, 'STORE_RESPONSE_CACHE', {})
+response_cache = LRUCache(
+    max_entries=_response_cache_settings.get('MAX_ENTRIES', 1000),
+    timeout=_response_cache_settings.get('TIMEOUT', 60))
+
+
+class CatalogCacheMixin:
+    """
+    Caches the serialized data of list and retrieve responses, keyed by the
+    full URL and the catalog version. The version moves forward whenever a
+    Product, Collection, Promotion or product tag changes (see store.signals), so entries
+    built from older catalog data are never looked up again. Views return
+    None from get_cache_key() for responses that must not be cached.
+    """
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def get_cache_key(self, request):
+        return (get_catalog_version(), request.build_absolute_uri())
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        key = self.get_cache_key(request)
+        if key is None:
+            return handler(request, *args, **kwargs)
+        data = response_cache.get(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        # A lagging replica may still return data older than the current
+        # version, which must not be served to everyone under it.
+        read_from_primary()
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response_cache.set(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+
+class ConditionalGetMixin:
+    """
+    Answers conditional list and retrieve requests (If-None-Match,
+    If-Modified-Since) with 304 Not Modified before the response body is
+    built. Views return `(etag_parts, last_modified)` from
+    get_list_validators() and get_retrieve_validators(), computed as
+    cheaply as possible, or None to skip the check.
+    """
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, self.get_list_validators, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, self.get_retrieve_validators, super().retrieve, *args, **kwargs)
+
+    def get_list_validators(self, request, *args, **kwargs):
+        return None
+
+    def get_retrieve_validators(self, request, *args, **kwargs):
+        return None
+
+    def conditional_response(self, request, get_validators, handler, *args, **kwargs):
+        # Validators must not be older than the data served elsewhere.
+        read_from_primary()
+        try:
+            validators = get_validators(request, *args, **kwargs)
+        except (TypeError, ValueError, ValidationError):
+            # A malformed lookup; the handler answers it with a 404.
+            validators = None
+        if validators is None:
+            return handler(request, *args, **kwargs)
+
+        etag_parts, last_modified = validators
+        # Weak, since the same data is rendered differently per format.
+        digest = hashlib.md5(repr((request.accepted_renderer.format, etag_parts)).encode()).hexdigest()
+        etag = f'W/"{digest}"'
+        last_modified = int(last_modified) if last_modified is not None else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
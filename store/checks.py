@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        'The default cache is not shared between worker processes.',
+        hint=('The catalog, permission and user cache versions live in the default cache; with a '
+              'per-process cache, changes made in one worker are not seen by the others. '
+              'Use a shared backend such as Redis.'),
+        id='store.W001',
+    )]
@@ -0,0 +1,52 @@
+"""
+Streaming catalog exports. Rows are read in keyset pages of CHUNK_SIZE and
+rendered one at a time, so memory use does not grow with the size of the
+catalog.
+"""
+import csv
+import json
+from rest_framework.utils.encoders import JSONEncoder
+
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    """A file-like object that hands back what csv.writer writes to it."""
+    def write(self, value):
+        return value
+
+
+def keyset_rows(queryset, fields, chunk_size=CHUNK_SIZE):
+    """
+    Yields the values() rows of `queryset` in id order with one query per
+    `chunk_size` rows. QuerySet.iterator() only streams on drivers with
+    server-side cursors; mysqlclient buffers the whole result.
+    """
+    queryset = queryset.order_by('id').values(*fields)
+    last_id = None
+    while True:
+        page = queryset if last_id is None else queryset.filter(id__gt=last_id)
+        rows = list(page[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1]['id']
+
+
+def ndjson_lines(rows):
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+def csv_lines(rows, fields):
+    writer = csv.DictWriter(Echo(), fieldnames=fields)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', lambda rows, fields: ndjson_lines(rows)),
+    'csv': ('text/csv', csv_lines),
+}
@@ -0,0 +1,211 @@
+"""
+Sharded inventory reservations.
+
+For products that have InventoryShard rows, the available stock is the sum
+of the shards, and Product.inventory only holds the settled stock:
+
+    Product.inventory = sum(shards) + pending and confirmed reservations
+
+Reserving stock decrements one shard with a conditional UPDATE, which only
+locks that shard row. Confirmed reservations are later settled into
+Product.inventory in one update per product, and pending reservations that
+expire are put back into their shard (see the settle_inventory command).
+Products without shards keep using Product.inventory directly.
+"""
+import random
+from datetime import timedelta
+from uuid import uuid4
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .cache import bump_catalog_version
+from .models import InventoryReservation, InventoryShard, Product
+
+DEFAULT_SHARDS = getattr(settings, 'STORE_INVENTORY_SHARDS', 8)
+RESERVATION_TIMEOUT = getattr(settings, 'STORE_INVENTORY_RESERVATION_TIMEOUT', 15 * 60)
+
+
+class InsufficientInventory(Exception):
+    def __init__(self, product_id):
+        super().__init__(f'Not enough inventory for product {product_id}.')
+        self.product_id = product_id
+
+
+def available_inventory():
+    """
+    An expression for the available stock of a product: the sum of its
+    shards if it has any, otherwise Product.inventory.
+    """
+    shards = InventoryShard.objects.filter(product=OuterRef('pk')) \
+        .order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    return Coalesce(Subquery(shards), F('inventory'))
+
+
+def sharded_product_ids(product_ids):
+    return set(InventoryShard.objects.filter(product_id__in=product_ids)
+               .values_list('product_id', flat=True).distinct())
+
+
+def reserve(product_id, quantity, token=None, confirmed=False, timeout=RESERVATION_TIMEOUT):
+    """
+    Takes `quantity` from the shards of a product and records it as a
+    reservation under `token`. Raises InsufficientInventory when the shards
+    together do not hold enough stock.
+    """
+    token = token or uuid4()
+    expires_at = timezone.now() + timedelta(seconds=timeout)
+
+    with transaction.atomic():
+        shards = list(InventoryShard.objects.filter(product_id=product_id).values_list('shard', flat=True))
+        random.shuffle(shards)
+        # Fast path: one conditional decrement on a random shard that holds
+        # enough stock; only that shard row is locked.
+        for shard in shards:
+            updated = InventoryShard.objects \
+                .filter(product_id=product_id, shard=shard, quantity__gte=quantity) \
+                .update(quantity=F('quantity') - quantity)
+            if updated:
+                InventoryReservation.objects.create(
+                    token=token, product_id=product_id, shard=shard, quantity=quantity,
+                    confirmed=confirmed, expires_at=expires_at)
+                break
+        else:
+            _reserve_across_shards(product_id, quantity, token, confirmed, expires_at)
+
+    bump_catalog_version()
+    return token
+
+
+def _reserve_across_shards(product_id, quantity, token, confirmed, expires_at):
+    # Slow path for requests larger than any single shard: lock every shard
+    # of the product and take what is needed from each.
+    shards = list(InventoryShard.objects.select_for_update()
+                  .filter(product_id=product_id, quantity__gt=0)
+                  .order_by('shard'))
+    if sum(shard.quantity for shard in shards) < quantity:
+        raise InsufficientInventory(product_id)
+
+    reservations = []
+    remaining = quantity
+    for shard in shards:
+        taken = min(shard.quantity, remaining)
+        shard.quantity -= taken
+        remaining -= taken
+        reservations.append(InventoryReservation(
+            token=token, product_id=product_id, shard=shard.shard, quantity=taken,
+            confirmed=confirmed, expires_at=expires_at))
+        if not remaining:
+            break
+    InventoryShard.objects.bulk_update(shards, ['quantity'])
+    InventoryReservation.objects.bulk_create(reservations)
+
+
+def confirm(token):
+    """Marks the pending reservations under `token` as sold. Returns False if they expired."""
+    return InventoryReservation.objects \
+        .filter(token=token, confirmed=False, expires_at__gt=timezone.now()) \
+        .update(confirmed=True) > 0
+
+
+def release(token):
+    """Puts the pending reservations under `token` back into their shards."""
+    return _release(InventoryReservation.objects.filter(token=token, confirmed=False))
+
+
+def release_expired():
+    return _release(InventoryReservation.objects.filter(confirmed=False, expires_at__lte=timezone.now()))
+
+
+def _release(reservations):
+    released = 0
+    with transaction.atomic():
+        for reservation in reservations.select_for_update():
+            InventoryShard.objects \
+                .filter(product_id=reservation.product_id, shard=reservation.shard) \
+                .update(quantity=F('quantity') + reservation.quantity)
+            reservation.delete()
+            released += 1
+    if released:
+        bump_catalog_version()
+    return released
+
+
+def settle():
+    """
+    Moves confirmed reservations into Product.inventory with one update per
+    product. Returns the number of products settled.
+    """
+    product_ids = InventoryReservation.objects.filter(confirmed=True) \
+        .order_by().values_list('product', flat=True).distinct()
+    settled = 0
+    for product_id in list(product_ids):
+        with transaction.atomic():
+            # Only the rows locked here are subtracted and deleted, so
+            # reservations confirmed meanwhile wait for the next run.
+            reservations = list(InventoryReservation.objects.select_for_update()
+                                .filter(product_id=product_id, confirmed=True)
+                                .values_list('pk', 'quantity'))
+            if not reservations:
+                continue
+            Product.objects.filter(pk=product_id) \
+                .update(inventory=F('inventory') - sum(quantity for pk, quantity in reservations))
+            InventoryReservation.objects.filter(pk__in=[pk for pk, quantity in reservations]).delete()
+            settled += 1
+    return settled
+
+
+def rebalance(product_id, shards=None):
+    """
+    Spreads the available stock of a product evenly over its shards,
+    creating `shards` rows if given. This also picks up restocks made by
+    editing Product.inventory.
+    """
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(pk=product_id)
+        if shards is not None:
+            InventoryShard.objects.filter(product=product, shard__gte=shards).delete()
+            InventoryShard.objects.bulk_create(
+                [InventoryShard(product=product, shard=shard) for shard in range(shards)],
+                ignore_conflicts=True)
+        rows = list(InventoryShard.objects.select_for_update().filter(product=product).order_by('shard'))
+        if not rows:
+            return
+        outstanding = InventoryReservation.objects.filter(product=product) \
+            .aggregate(total=Coalesce(Sum('quantity'), 0))['total']
+        available = max(product.inventory - outstanding, 0)
+        share, extra = divmod(available, len(rows))
+        for index, row in enumerate(rows):
+            row.quantity = share + (1 if index < extra else 0)
+        InventoryShard.objects.bulk_update(rows, ['quantity'])
+    bump_catalog_version()
+
+
+def clear(product_ids):
+    """
+    Sets the stock of the given products to zero: Product.inventory, their
+    shards and every outstanding reservation, so nothing is sold from the
+    shards afterwards and settling can't push the inventory negative.
+    Returns the number of products cleared.
+    """
+    with transaction.atomic():
+        product_ids = list(Product.objects.select_for_update().filter(pk__in=product_ids)
+                           .values_list('pk', flat=True))
+        InventoryReservation.objects.filter(product_id__in=product_ids).delete()
+        InventoryShard.objects.filter(product_id__in=product_ids).update(quantity=0)
+        cleared = Product.objects.filter(pk__in=product_ids).update(inventory=0, last_update=timezone.now())
+    bump_catalog_version()
+    return cleared
+
+
+def unshard(product_id):
+    """Settles a product and goes back to locking Product.inventory directly."""
+    with transaction.atomic():
+        Product.objects.select_for_update().get(pk=product_id)
+        if InventoryReservation.objects.filter(product_id=product_id, confirmed=False).exists():
+            return False
+        settle()
+        InventoryShard.objects.filter(product_id=product_id).delete()
+    bump_catalog_version()
+    return True
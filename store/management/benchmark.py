@@ -0,0 +1,6 @@
+def percentile(values, percent):
+    """Returns the given percentile of sorted latencies (in seconds) as milliseconds."""
+    if not values:
+        return None
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return round(values[index] * 1000, 2)
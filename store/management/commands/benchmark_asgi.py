@@ -0,0 +1,97 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client
+from store.management.benchmark import percentile
+from store.models import Cart, CartItem, Product
+
+# Sync endpoint and its async variant, formatted with the fixture ids.
+ENDPOINTS = {
+    'product-list': ('/store/products/', '/store/async/products/'),
+    'product-detail': ('/store/products/{product}/', '/store/async/products/{product}/'),
+    'collection-list': ('/store/collections/', '/store/async/collections/'),
+    'cart-detail': ('/store/carts/{cart}/', '/store/async/carts/{cart}/'),
+}
+
+
+class Command(BaseCommand):
+    help = ('Compares the read endpoints under the WSGI handler (a thread per request), the ASGI handler '
+            'with the sync views, and the ASGI handler with the async views, at the same concurrency.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=64, help='Requests in flight at once.')
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per endpoint and mode.')
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), action='append',
+                            help='Endpoint to run; can be repeated. Defaults to all of them.')
+        parser.add_argument('--host', default='localhost', help='Host header, must be in ALLOWED_HOSTS.')
+
+    def handle(self, *args, **options):
+        if settings.DEBUG:
+            self.stderr.write('DEBUG is on: query logging and the debug toolbar will dominate the timings.')
+        product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True)[:3])
+        if not product_ids:
+            raise CommandError('At least one product is needed.')
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create([CartItem(cart=cart, product_id=pk, quantity=1) for pk in product_ids])
+        ids = {'product': product_ids[0], 'cart': cart.pk}
+
+        report = {'vendor': connection.vendor, 'concurrency': options['concurrency'], 'endpoints': {}}
+        try:
+            for name in options['endpoint'] or ENDPOINTS:
+                sync_path, async_path = (path.format(**ids) for path in ENDPOINTS[name])
+                report['endpoints'][name] = {
+                    'wsgi': self.run_wsgi(sync_path, options),
+                    'asgi_sync_views': asyncio.run(self.run_asgi(sync_path, options)),
+                    'asgi_async_views': asyncio.run(self.run_asgi(async_path, options)),
+                }
+        finally:
+            cart.delete()
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def run_wsgi(self, path, options):
+        local = threading.local()
+
+        def fetch(_):
+            if not hasattr(local, 'client'):
+                local.client = Client(headers={'host': options['host']})
+            started = time.perf_counter()
+            response = local.client.get(path)
+            return time.perf_counter() - started, response.status_code
+
+        fetch(None)
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            started = time.perf_counter()
+            results = list(pool.map(fetch, range(options['requests'])))
+            elapsed = time.perf_counter() - started
+        return self.summarize(results, elapsed)
+
+    async def run_asgi(self, path, options):
+        client = AsyncClient(headers={'host': options['host']})
+        in_flight = asyncio.Semaphore(options['concurrency'])
+
+        async def fetch():
+            async with in_flight:
+                started = time.perf_counter()
+                response = await client.get(path)
+                return time.perf_counter() - started, response.status_code
+
+        await fetch()
+        started = time.perf_counter()
+        results = await asyncio.gather(*(fetch() for _ in range(options['requests'])))
+        elapsed = time.perf_counter() - started
+        return self.summarize(results, elapsed)
+
+    def summarize(self, results, elapsed):
+        latencies = sorted(latency for latency, status in results)
+        return {
+            'requests': len(results),
+            'errors': sum(1 for latency, status in results if status != 200),
+            'requests_per_second': round(len(results) / elapsed, 1),
+            'p50_ms': percentile(latencies, 50),
+            'p99_ms': percentile(latencies, 99),
+        }
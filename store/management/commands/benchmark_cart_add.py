@@ -0,0 +1,89 @@
+import json
+import threading
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from store.management.benchmark import percentile
+from store.models import Cart, CartItem, Product
+
+
+class Command(BaseCommand):
+    help = 'Adds items to one cart from many threads at once and checks that no quantity is lost.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--adds', type=int, default=100, help='Adds per thread.')
+        parser.add_argument('--products', type=int, default=3, help='Distinct products to add.')
+        parser.add_argument(
+            '--naive', action='store_true',
+            help='Use a read-modify-write (get then save) instead of the upsert, for comparison.')
+
+    def handle(self, *args, **options):
+        product_ids = list(Product.objects.values_list('id', flat=True)[:options['products']])
+        if not product_ids:
+            raise CommandError('At least one product is needed.')
+
+        cart = Cart.objects.create()
+        errors = []
+        latencies = []
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(options['threads'])
+
+        def worker(index):
+            start_barrier.wait()
+            try:
+                for n in range(options['adds']):
+                    product_id = product_ids[(index + n) % len(product_ids)]
+                    started = time.perf_counter()
+                    try:
+                        if options['naive']:
+                            self.naive_add(cart.id, product_id)
+                        else:
+                            CartItem.objects.add(cart.id, product_id, 1)
+                    except Exception as error:
+                        with lock:
+                            errors.append(repr(error))
+                        continue
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        stored = sum(CartItem.objects.filter(cart=cart).values_list('quantity', flat=True))
+        cart.delete()
+
+        latencies.sort()
+        attempted = options['threads'] * options['adds']
+        report = {
+            'mode': 'naive' if options['naive'] else 'upsert',
+            'vendor': connection.vendor,
+            'threads': options['threads'],
+            'attempted': attempted,
+            'succeeded': len(latencies),
+            'errors': len(errors),
+            'lost_updates': len(latencies) - stored,
+            'adds_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': percentile(latencies, 50),
+            'p99_ms': percentile(latencies, 99),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+        if errors:
+            self.stderr.write('First errors: %s' % ', '.join(errors[:5]))
+
+    def naive_add(self, cart_id, product_id):
+        with transaction.atomic():
+            try:
+                item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
+                item.quantity += 1
+                item.save()
+            except CartItem.DoesNotExist:
+                CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=1)
+
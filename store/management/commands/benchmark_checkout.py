@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from store.management.benchmark import percentile
+from store import inventory
+from store.models import Cart, CartItem, Customer, InventoryReservation, InventoryShard, Order, OrderItem, Product
+from store.serializers import CheckoutSerializer
+
+
+class Command(BaseCommand):
+    help = 'Runs concurrent checkouts against the same hot products and reports throughput.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--checkouts', type=int, default=25, help='Checkouts per thread.')
+        parser.add_argument('--products', type=int, default=3, help='Hot products shared by every cart.')
+        parser.add_argument('--lines', type=int, default=2, help='Lines per cart.')
+        parser.add_argument(
+            '--shards', type=int, default=0,
+            help='Split the stock of the hot products over this many inventory shards during the run.')
+
+    def handle(self, *args, **options):
+        products = list(Product.objects.order_by('pk')[:options['products']])
+        if not products:
+            raise CommandError('At least one product is needed.')
+
+        user = get_user_model().objects.create_user(
+            username=f'checkout-benchmark-{time.time_ns()}', email=f'{time.time_ns()}@benchmark.invalid')
+        customer = Customer.objects.create(user=user)
+        original_inventory = {product.id: product.inventory for product in products}
+        originally_sharded = inventory.sharded_product_ids(original_inventory)
+        benchmark_started = timezone.now()
+
+        carts = []
+        for index in range(options['threads'] * options['checkouts']):
+            cart = Cart.objects.create()
+            carts.append(cart.id)
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=products[(index + line) % len(products)], quantity=1)
+                for line in range(min(options['lines'], len(products)))
+            ])
+        Product.objects.filter(pk__in=original_inventory).update(inventory=len(carts) * options['lines'])
+        for product_id in original_inventory:
+            if options['shards']:
+                inventory.rebalance(product_id, shards=options['shards'])
+            elif product_id in originally_sharded:
+                inventory.rebalance(product_id)
+
+        latencies, errors, rejected = [], [], []
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(options['threads'])
+
+        def worker(cart_ids):
+            start_barrier.wait()
+            try:
+                for cart_id in cart_ids:
+                    started = time.perf_counter()
+                    serializer = CheckoutSerializer(data={'cart_id': cart_id}, context={'user_id': user.id})
+                    try:
+                        serializer.is_valid(raise_exception=True)
+                        serializer.save()
+                    except ValidationError as error:
+                        with lock:
+                            rejected.append(error.detail)
+                        continue
+                    except Exception as error:
+                        with lock:
+                            errors.append(repr(error))
+                        continue
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        chunks = [carts[index::options['threads']] for index in range(options['threads'])]
+        threads = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        ordered = sum(OrderItem.objects.filter(order__customer=customer).values_list('quantity', flat=True))
+        remaining = sum(Product.objects.filter(pk__in=original_inventory)
+                        .annotate(available=inventory.available_inventory())
+                        .values_list('available', flat=True))
+        stock = len(carts) * options['lines'] * len(original_inventory)
+
+        OrderItem.objects.filter(order__customer=customer).delete()
+        Order.objects.filter(customer=customer).delete()
+        Cart.objects.filter(pk__in=carts).delete()
+        customer.delete()
+        user.delete()
+        InventoryReservation.objects.filter(
+            product_id__in=original_inventory, confirmed=True, created_at__gte=benchmark_started).delete()
+        for product_id, quantity in original_inventory.items():
+            Product.objects.filter(pk=product_id).update(inventory=quantity)
+            if product_id in originally_sharded:
+                inventory.rebalance(product_id)
+            else:
+                InventoryShard.objects.filter(product_id=product_id).delete()
+
+        latencies.sort()
+        report = {
+            'vendor': connection.vendor,
+            'threads': options['threads'],
+            'shards': options['shards'],
+            'attempted': len(carts),
+            'succeeded': len(latencies),
+            'rejected': len(rejected),
+            'errors': len(errors),
+            'inventory_consistent': stock - remaining == ordered,
+            'checkouts_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': percentile(latencies, 50),
+            'p99_ms': percentile(latencies, 99),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+        if errors:
+            self.stderr.write('First errors: %s' % ', '.join(errors[:5]))
+
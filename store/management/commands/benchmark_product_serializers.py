@@ -0,0 +1,62 @@
+import json
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from store.models import Product
+from store.serializers import ProductListSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compares ProductSerializer with the values() fast path used by the product list, in rows per second.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Products per serialized page.')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        rows = [
+            {
+                'id': index,
+                'title': f'Product {index}',
+                'slug': f'product-{index}',
+                'description': 'Benchmark product',
+                'inventory': index % 100,
+                'available_inventory': index % 100,
+                'unit_price': Decimal(index % 500) + Decimal('0.99'),
+                'collection_id': index % 10 + 1,
+                'last_update': now,
+            }
+            for index in range(1, options['rows'] + 1)
+        ]
+        products = []
+        for row in rows:
+            product = Product(**{key: value for key, value in row.items() if key != 'available_inventory'})
+            product.available_inventory = row['available_inventory']
+            products.append(product)
+
+        renderer = JSONRenderer()
+        serializer_output = renderer.render(ProductSerializer(products, many=True).data)
+        fast_output = renderer.render(ProductListSerializer(rows).data)
+        if serializer_output != fast_output:
+            raise CommandError('The fast path does not render the same JSON as ProductSerializer.')
+
+        report = {
+            'rows': options['rows'],
+            'identical_output': True,
+            'serializer_rows_per_second': self.measure(
+                lambda: renderer.render(ProductSerializer(products, many=True).data), options),
+            'fast_path_rows_per_second': self.measure(
+                lambda: renderer.render(ProductListSerializer(rows).data), options),
+        }
+        report['speedup'] = round(report['fast_path_rows_per_second'] / report['serializer_rows_per_second'], 1)
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def measure(self, render, options):
+        started = time.perf_counter()
+        for _ in range(options['repeat']):
+            render()
+        elapsed = time.perf_counter() - started
+        return round(options['rows'] * options['repeat'] / elapsed, 1)
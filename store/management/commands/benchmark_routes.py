@@ -0,0 +1,172 @@
+import json
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework.test import APIClient
+from store import urls
+from store.authentication import user_cache
+from store.backends import permission_cache
+from store.cache import response_cache
+from likes.buffer import like_buffer
+from store import inventory
+from store.management.benchmark import percentile
+from store.models import (Cart, CartItem, Collection, Customer, InventoryReservation, InventoryShard, Order, OrderItem,
+                          Product, Review)
+
+
+def url(name, *keys):
+    return lambda fixtures: (reverse(name, args=[fixtures[key] for key in keys]), None)
+
+
+def bulk_cart_items(fixtures):
+    items = [{'product_id': product_id, 'quantity': 1} for product_id in fixtures['products']]
+    return reverse('cart-items-bulk', args=[fixtures['scratch_cart']]), {'items': items, 'replace': True}
+
+
+def checkout(fixtures):
+    cart = Cart.objects.create()
+    CartItem.objects.bulk_create([CartItem(cart=cart, product_id=product_id, quantity=1)
+                                  for product_id in fixtures['products']])
+    return reverse('order-checkout'), {'cart_id': str(cart.id)}
+
+
+# Route name, method and a function returning the URL and body for a request.
+ROUTES = [
+    ('api-root', 'get', url('api-root')),
+    ('product-list', 'get', url('product-list')),
+    ('product-detail', 'get', url('product-detail', 'product')),
+    ('product-export', 'get', url('product-export')),
+    ('product-like', 'post', url('product-like', 'product')),
+    ('product-reviews-list', 'get', url('product-reviews-list', 'product')),
+    ('product-reviews-detail', 'get', url('product-reviews-detail', 'product', 'review')),
+    ('collection-list', 'get', url('collection-list')),
+    ('collection-detail', 'get', url('collection-detail', 'collection')),
+    ('cart-list', 'post', url('cart-list')),
+    ('cart-detail', 'get', url('cart-detail', 'cart')),
+    ('cart-items-list', 'get', url('cart-items-list', 'cart')),
+    ('cart-items-detail', 'get', url('cart-items-detail', 'cart', 'cart_item')),
+    ('cart-items-bulk', 'post', bulk_cart_items),
+    ('order-list', 'get', url('order-list')),
+    ('order-detail', 'get', url('order-detail', 'order')),
+    ('order-checkout', 'post', checkout),
+    ('customer-list', 'get', url('customer-list')),
+    ('customer-detail', 'get', url('customer-detail', 'customer')),
+    ('customer-history', 'get', url('customer-history', 'customer')),
+    ('customer-me', 'get', url('customer-me')),
+    ('async-product-list', 'get', url('async-product-list')),
+    ('async-product-detail', 'get', url('async-product-detail', 'product')),
+    ('async-collection-list', 'get', url('async-collection-list')),
+    ('async-cart-detail', 'get', url('async-cart-detail', 'cart')),
+]
+
+
+class Command(BaseCommand):
+    help = ('Requests every route in store/urls.py in process against the current database (see seed_store) '
+            'and reports latency percentiles, throughput and query counts as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100, help='Requests per route.')
+        parser.add_argument('--route', action='append', help='Route name to run; can be repeated.')
+        parser.add_argument('--cold', action='store_true',
+                            help='Clear the in-process response, user and permission caches before each request.')
+        parser.add_argument('--checkout', action='store_true',
+                            help='Also run order-checkout, which places real orders and consumes stock.')
+        parser.add_argument('--host', default='localhost', help='Host header, must be in ALLOWED_HOSTS.')
+
+    def handle(self, *args, **options):
+        if settings.DEBUG:
+            self.stderr.write('DEBUG is on: query logging and the debug toolbar will dominate the timings.')
+        routes = [route for route in ROUTES if not options['route'] or route[0] in options['route']]
+        if not options['checkout']:
+            routes = [route for route in routes if route[0] != 'order-checkout']
+
+        fixtures = self.fixtures()
+        original_inventory = dict(Product.objects.filter(pk__in=fixtures['products']).values_list('pk', 'inventory'))
+        sharded = inventory.sharded_product_ids(original_inventory)
+        benchmark_started = timezone.now()
+        user = get_user_model().objects.create_superuser(
+            f'route-benchmark-{time.time_ns()}', 'route-benchmark@example.com', None)
+        client = APIClient(headers={'host': options['host']})
+        client.force_authenticate(user)
+        created_carts = [fixtures['scratch_cart']]
+
+        report = {'vendor': connection.vendor, 'iterations': options['iterations'], 'cold': options['cold'],
+                  'routes': {}}
+        try:
+            for name, method, build in routes:
+                latencies, queries, errors = [], [], 0
+                for _ in range(options['iterations']):
+                    path, data = build(fixtures)
+                    if options['cold']:
+                        response_cache.clear()
+                        user_cache.clear()
+                        permission_cache.clear()
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        response = getattr(client, method)(path, data, format='json')
+                        if response.streaming:
+                            b''.join(response.streaming_content)
+                        latencies.append(time.perf_counter() - started)
+                    queries.append(len(captured))
+                    if response.status_code >= 400:
+                        errors += 1
+                    elif name == 'cart-list':
+                        created_carts.append(response.data['id'])
+
+                latencies.sort()
+                report['routes'][name] = {
+                    'method': method.upper(),
+                    'url': path,
+                    'requests': len(latencies),
+                    'errors': errors,
+                    'requests_per_second': round(len(latencies) / sum(latencies), 1),
+                    'p50_ms': percentile(latencies, 50),
+                    'p95_ms': percentile(latencies, 95),
+                    'p99_ms': percentile(latencies, 99),
+                    'queries_per_request': round(sum(queries) / len(queries), 1),
+                    'max_queries': max(queries),
+                }
+        finally:
+            Cart.objects.filter(pk__in=created_carts).delete()
+            OrderItem.objects.filter(order__customer__user=user).delete()
+            Order.objects.filter(customer__user=user).delete()
+            like_buffer.flush()
+            user.delete()
+            InventoryReservation.objects.filter(
+                product_id__in=original_inventory, confirmed=True, created_at__gte=benchmark_started).delete()
+            for product_id, quantity in original_inventory.items():
+                Product.objects.filter(pk=product_id).update(inventory=quantity)
+                if product_id in sharded:
+                    inventory.rebalance(product_id)
+                else:
+                    InventoryShard.objects.filter(product_id=product_id).delete()
+
+        run = {name for name, method, build in routes}
+        report['not_run'] = sorted({pattern.name for pattern in urls.urlpatterns} - run)
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def fixtures(self):
+        review = Review.objects.order_by('pk').first()
+        cart_item = CartItem.objects.order_by('pk').first()
+        order = Order.objects.order_by('pk').first()
+        customer = Customer.objects.order_by('pk').first()
+        collection = Collection.objects.order_by('-product_count').first()
+        products = list(Product.objects.filter(inventory__gt=0).order_by('pk').values_list('pk', flat=True)[:2])
+        if not all([review, cart_item, order, customer, collection, products]):
+            raise CommandError('The database needs products, reviews, carts, orders and customers; run seed_store.')
+        return {
+            'product': review.product_id,
+            'review': review.pk,
+            'cart': cart_item.cart_id,
+            'cart_item': cart_item.pk,
+            'scratch_cart': Cart.objects.create().pk,
+            'order': order.pk,
+            'customer': customer.pk,
+            'collection': collection.pk,
+            'products': products,
+        }
@@ -0,0 +1,98 @@
+import json
+import time
+from datetime import timedelta
+from uuid import uuid4
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from store.management.benchmark import percentile
+from store.models import RevokedToken
+from store.revocation import RevocationStore
+from store.serializers import RevocableTokenRefreshSerializer
+
+
+class Command(BaseCommand):
+    help = 'Measures refresh token throughput with a large number of revoked tokens on file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--revoked', type=int, default=1_000_000)
+        parser.add_argument('--refreshes', type=int, default=2000)
+        parser.add_argument(
+            '--database-only', action='store_true',
+            help='Check every token against the database, as the blacklist app does, for comparison.')
+
+    def handle(self, *args, **options):
+        prefix = f'benchmark-{uuid4().hex[:8]}-'
+        try:
+            self.run(prefix, options)
+        finally:
+            RevokedToken.objects.filter(jti__startswith=prefix).delete()
+
+    def run(self, prefix, options):
+        expires_at = timezone.now() + timedelta(days=1)
+        started = time.perf_counter()
+        batch = []
+        for index in range(options['revoked']):
+            batch.append(RevokedToken(jti=f'{prefix}{index}', expires_at=expires_at))
+            if len(batch) == 10000:
+                RevokedToken.objects.bulk_create(batch)
+                batch = []
+        RevokedToken.objects.bulk_create(batch)
+        seeded = time.perf_counter() - started
+
+        user = get_user_model().objects.create_user(
+            username=f'refresh-{prefix}', email=f'{prefix}@benchmark.invalid')
+        store = RevocationStore()
+        started = time.perf_counter()
+        store.is_revoked('warm-up')
+        loaded = time.perf_counter() - started
+        filter_bytes = len(store.filter.bits)
+        if options['database_only']:
+            store.filter = _Everything()
+
+        serializer_class = type('BenchmarkRefreshSerializer', (RevocableTokenRefreshSerializer,),
+                                {'revocation_store': store})
+        rotated = []
+        latencies = []
+        try:
+            token = RefreshToken.for_user(user)
+            started = time.perf_counter()
+            for _ in range(options['refreshes']):
+                rotated.append(token[api_settings.JTI_CLAIM])
+                request_started = time.perf_counter()
+                serializer = serializer_class(data={'refresh': str(token)})
+                serializer.is_valid(raise_exception=True)
+                latencies.append(time.perf_counter() - request_started)
+                token = RefreshToken(serializer.validated_data.get('refresh', str(token)))
+            elapsed = time.perf_counter() - started
+        finally:
+            RevokedToken.objects.filter(jti__in=rotated).delete()
+            user.delete()
+
+        latencies.sort()
+        report = {
+            'vendor': connection.vendor,
+            'mode': 'database' if options['database_only'] else 'bloom',
+            'revoked_tokens': options['revoked'],
+            'seed_seconds': round(seeded, 2),
+            'filter_load_seconds': round(loaded, 2),
+            'filter_bytes': filter_bytes,
+            'refreshes': options['refreshes'],
+            'refreshes_per_second': round(options['refreshes'] / elapsed, 1),
+            'p50_ms': percentile(latencies, 50),
+            'p99_ms': percentile(latencies, 99),
+            **store.stats(),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+
+class _Everything:
+    """A stand-in filter that sends every check to the database."""
+    def __contains__(self, value):
+        return True
+
+    def add(self, value):
+        pass
@@ -0,0 +1,141 @@
+import csv
+import json
+import time
+from itertools import islice
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+from store import inventory
+from store.cache import bump_catalog_version
+from store.models import Collection, InventoryShard, Product, Promotion
+
+# For each feed: the model, the columns read from a row and the fields
+# overwritten when a row with the same id already exists.
+FEEDS = {
+    'products': (
+        Product,
+        ['id', 'title', 'slug', 'description', 'unit_price', 'inventory', 'collection_id'],
+        ['title', 'slug', 'description', 'unit_price', 'inventory', 'collection', 'last_update']),
+    'collections': (Collection, ['id', 'title'], ['title']),
+    'promotions': (Promotion, ['id', 'description', 'discount'], ['description', 'discount']),
+}
+
+# Rejected rows are counted, but only the first few are kept for the report.
+REPORTED_ERRORS = 10
+
+
+class Command(BaseCommand):
+    help = 'Streams a CSV or NDJSON feed of products, collections or promotions into the catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(FEEDS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        model, columns, fields = FEEDS[options['model']]
+        feed_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'ndjson')
+        # MySQL upserts on any unique key and rejects an explicit target.
+        unique_fields = ['id'] if connection.features.supports_update_conflicts_with_target else None
+
+        rows = self.read_rows(options['path'], feed_format)
+        imported, rejected, errors = 0, 0, []
+        started = time.perf_counter()
+        line = 0
+        while batch := list(islice(rows, options['batch_size'])):
+            collections = self.collections(batch) if model is Product else None
+            objects = {}
+            for row in batch:
+                line += 1
+                try:
+                    if isinstance(row, ValueError):
+                        raise row
+                    instance = self.build(model, columns, row, collections)
+                    instance.clean_fields(exclude=['collection'])
+                except (ValidationError, ValueError, KeyError, TypeError, AttributeError) as error:
+                    rejected += 1
+                    if len(errors) < REPORTED_ERRORS:
+                        errors.append(f'row {line}: {error}')
+                    continue
+                # A feed may repeat an id; the last row wins, as one upsert can't touch a row twice.
+                objects[instance.pk if instance.pk is not None else ('new', line)] = instance
+            with transaction.atomic():
+                model.objects.bulk_create(
+                    objects.values(), update_conflicts=True, unique_fields=unique_fields, update_fields=fields)
+            imported += len(objects)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{line} rows read, {imported} imported')
+        elapsed = time.perf_counter() - started
+
+        # bulk_create skips the signals that keep the counters, inventory
+        # shards and cached responses in sync.
+        if model is Product:
+            call_command('rebuild_product_counts', stdout=self.stdout)
+            for product_id in InventoryShard.objects.values_list('product_id', flat=True).distinct():
+                inventory.rebalance(product_id)
+        else:
+            bump_catalog_version()
+
+        for error in errors:
+            self.stderr.write(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} of {line} {options["model"]} rows in {elapsed:.1f}s '
+            f'({line / elapsed if elapsed else 0:.0f} rows/s), {rejected} rejected.'))
+
+    def read_rows(self, path, feed_format):
+        try:
+            with open(path, newline='', encoding='utf-8') as feed:
+                if feed_format == 'csv':
+                    yield from csv.DictReader(feed)
+                else:
+                    for line in feed:
+                        if line.strip():
+                            # A malformed line is rejected like any other bad row.
+                            try:
+                                yield json.loads(line)
+                            except ValueError as error:
+                                yield error
+        except OSError as error:
+            raise CommandError(error)
+
+    def collections(self, batch):
+        """
+        Returns the ids of the collections the batch refers to, by title and
+        by id, in one query; if titles repeat, the oldest collection wins.
+        """
+        titles, ids = set(), set()
+        for row in batch:
+            if not isinstance(row, dict):
+                continue
+            if row.get('collection'):
+                titles.add(row['collection'])
+            if row.get('collection_id') not in (None, ''):
+                try:
+                    ids.add(Collection._meta.pk.to_python(row['collection_id']))
+                except ValidationError:
+                    pass
+        found = Collection.objects.filter(Q(title__in=titles) | Q(pk__in=ids)).order_by('-id').values_list('title', 'id')
+        return {
+            'titles': {title: pk for title, pk in found if title in titles},
+            'ids': {pk for title, pk in found},
+        }
+
+    def build(self, model, columns, row, collections):
+        values = {column: row[column] for column in columns if row.get(column) not in (None, '')}
+        if model is Product:
+            if 'collection_id' in values:
+                # Not covered by clean_fields(); an unknown id would fail the whole batch.
+                values['collection_id'] = Collection._meta.pk.to_python(values['collection_id'])
+                if values['collection_id'] not in collections['ids']:
+                    raise ValueError(f'unknown collection id {row["collection_id"]!r}')
+            else:
+                if row.get('collection') not in collections['titles']:
+                    raise ValueError(f'unknown collection {row.get("collection")!r}')
+                values['collection_id'] = collections['titles'][row['collection']]
+            values.setdefault('slug', slugify(row.get('title', '')))
+        return model(**values)
+
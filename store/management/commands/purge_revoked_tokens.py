@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from store.models import RevokedToken
+
+
+class Command(BaseCommand):
+    help = 'Deletes revoked refresh tokens that have expired. Run it periodically, e.g. hourly from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        deleted = 0
+        # Deleting in batches keeps each transaction and its locks short.
+        while True:
+            ids = list(RevokedToken.objects.filter(expires_at__lte=now)
+                       .values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            deleted += RevokedToken.objects.filter(id__in=ids).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired revoked tokens.'))
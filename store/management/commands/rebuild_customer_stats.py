@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from store.models import CustomerOrderStats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the CustomerOrderStats rows from the order tables.'
+
+    def handle(self, *args, **options):
+        updated = CustomerOrderStats.objects.refresh()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt order stats for {updated} customers.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from store.cache import bump_catalog_version
+from store.models import Collection, Product
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored Collection.product_count counters from the product table.'
+
+    def handle(self, *args, **options):
+        counts = Product.objects.filter(collection=OuterRef('pk')) \
+            .order_by().values('collection').annotate(count=Count('id')).values('count')
+        updated = Collection.objects.update(product_count=Coalesce(Subquery(counts), 0))
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt product counts for {updated} collections.'))
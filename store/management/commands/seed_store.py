@@ -0,0 +1,145 @@
+import random
+import time
+from itertools import accumulate
+from uuid import uuid4
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.text import slugify
+from likes.models import LikedItem
+from store.models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, Promotion, Review
+from tags.models import Tag, TaggedItem
+
+WORDS = ('acme', 'basic', 'classic', 'deluxe', 'eco', 'fresh', 'giant', 'handmade', 'instant', 'jumbo',
+         'lite', 'mini', 'natural', 'organic', 'premium', 'quick', 'royal', 'smart', 'tiny', 'ultra')
+NOUNS = ('apple', 'bread', 'candle', 'drill', 'espresso', 'fork', 'glove', 'hammer', 'ink', 'jacket',
+         'kettle', 'lamp', 'mug', 'notebook', 'oil', 'pan', 'quilt', 'rug', 'soap', 'towel')
+
+
+class Command(BaseCommand):
+    help = ('Generates a realistic, skewed catalog with customers, orders, carts, reviews, tags and likes '
+            'using bulk inserts. A few products and customers get most of the activity.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collections', type=int, default=50)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--promotions', type=int, default=20)
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--carts', type=int, default=2000)
+        parser.add_argument('--reviews', type=int, default=20000)
+        parser.add_argument('--tags', type=int, default=100)
+        parser.add_argument('--likes', type=int, default=50000)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Zipf exponent of product and customer popularity.')
+        parser.add_argument('--seed', type=int, help='Random seed, for reproducible data sets.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.skew = options['skew']
+        run = uuid4().hex[:8]
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            promotions = self.insert(Promotion, [
+                Promotion(description=f'Promotion {n}', discount=self.random.choice((0.05, 0.1, 0.2, 0.5)))
+                for n in range(options['promotions'])])
+            collections = self.insert(Collection, [
+                Collection(title=f'{self.random.choice(WORDS).title()} {self.random.choice(NOUNS)}s {n}')
+                for n in range(options['collections'])])
+
+            # Collection sizes are skewed too.
+            pick_collection = self.zipf(collections)
+            products = []
+            for n in range(options['products']):
+                title = f'{self.random.choice(WORDS).title()} {self.random.choice(NOUNS)} {run}-{n}'
+                products.append(Product(
+                    title=title, slug=slugify(title), description=f'{title}, seeded for load tests.',
+                    unit_price=self.random.randint(100, 99999) / 100,
+                    inventory=self.random.randint(0, 500), collection_id=pick_collection()))
+            products = self.insert(Product, products)
+            prices = dict(Product.objects.filter(pk__in=products).values_list('id', 'unit_price'))
+            if promotions:
+                self.insert(Product.promotions.through, [
+                    Product.promotions.through(product_id=product_id, promotion_id=self.random.choice(promotions))
+                    for product_id in self.random.sample(products, len(products) // 10)])
+
+            password = make_password(None)
+            users = self.insert(get_user_model(), [
+                get_user_model()(username=f'seed-{run}-{n}', email=f'seed-{run}-{n}@example.com',
+                                 first_name=self.random.choice(NOUNS).title(), password=password)
+                for n in range(options['customers'])])
+            customers = self.insert(Customer, [
+                Customer(user_id=user_id, phone=f'555-{n:04d}',
+                         membership=self.random.choice('BBBSSG')) for n, user_id in enumerate(users)])
+
+            pick_product = self.zipf(products)
+            pick_customer = self.zipf(customers)
+            orders = self.insert(Order, [
+                Order(customer_id=pick_customer(), payment_status=self.random.choice('PCCCCF'))
+                for _ in range(options['orders'])])
+            order_items = []
+            for order_id in orders:
+                for product_id in self.distinct(pick_product, self.random.randint(1, 5)):
+                    order_items.append(OrderItem(order_id=order_id, product_id=product_id,
+                                                 quantity=self.random.randint(1, 3), unit_price=prices[product_id]))
+            self.insert(OrderItem, order_items)
+
+            carts = [Cart() for _ in range(options['carts'])]
+            Cart.objects.bulk_create(carts, batch_size=self.batch_size)
+            self.insert(CartItem, [
+                CartItem(cart_id=cart.id, product_id=product_id, quantity=self.random.randint(1, 5))
+                for cart in carts for product_id in self.distinct(pick_product, self.random.randint(1, 5))])
+
+            self.insert(Review, [
+                Review(product_id=pick_product(), name=self.random.choice(NOUNS).title(),
+                       description=f'Seeded review {n}.') for n in range(options['reviews'])])
+
+            product_type = ContentType.objects.get_for_model(Product)
+            tags = self.insert(Tag, [Tag(label=f'{self.random.choice(WORDS)}-{n}') for n in range(options['tags'])])
+            if tags:
+                pick_tag = self.zipf(tags)
+                self.insert(TaggedItem, [
+                    TaggedItem(tag_id=tag_id, content_type=product_type, object_id=product_id)
+                    for product_id in products for tag_id in self.distinct(pick_tag, self.random.randint(0, 4))])
+
+            pick_user = self.zipf(users)
+            likes = {(pick_user(), pick_product()) for _ in range(options['likes'])}
+            self.insert(LikedItem, [
+                LikedItem(user_id=user_id, content_type=product_type, object_id=product_id)
+                for user_id, product_id in likes])
+
+        # bulk_create skips the signals that maintain the denormalized data.
+        call_command('rebuild_product_counts', stdout=self.stdout)
+        call_command('rebuild_like_counts', stdout=self.stdout)
+        call_command('rebuild_customer_stats', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(products)} products, {len(customers)} customers, {len(orders)} orders '
+            f'({len(order_items)} lines), {len(carts)} carts, {len(likes)} likes '
+            f'in {time.perf_counter() - started:.1f}s.'))
+
+    def insert(self, model, objects):
+        """Bulk inserts `objects` and returns their ids, also where bulk_create can't set them."""
+        last_id = model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        return list(model.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True))
+
+    def zipf(self, values):
+        """Returns a function picking from `values`, the first ones far more often than the rest."""
+        values = list(values)
+        self.random.shuffle(values)
+        weights = list(accumulate(1 / (rank ** self.skew) for rank in range(1, len(values) + 1)))
+        return lambda: self.random.choices(values, cum_weights=weights)[0]
+
+    def distinct(self, pick, count, attempts=3):
+        picked = set()
+        for _ in range(count * attempts):
+            if len(picked) == count:
+                break
+            picked.add(pick())
+        return picked
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store import inventory
+
+
+class Command(BaseCommand):
+    help = ('Releases expired inventory reservations and settles confirmed ones into Product.inventory. '
+            'Run it periodically, e.g. every minute from cron.')
+
+    def handle(self, *args, **options):
+        released = inventory.release_expired()
+        settled = inventory.settle()
+        self.stdout.write(self.style.SUCCESS(
+            f'Released {released} expired reservations, settled {settled} products.'))
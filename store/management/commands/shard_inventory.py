@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from store import inventory
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Splits the stock of hot products over several counter rows, or merges it back with --disable.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='+', type=int)
+        parser.add_argument('--shards', type=int, default=inventory.DEFAULT_SHARDS)
+        parser.add_argument('--disable', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['shards'] < 1:
+            raise CommandError('--shards must be at least 1.')
+        for product_id in options['product_ids']:
+            if not Product.objects.filter(pk=product_id).exists():
+                raise CommandError(f'Product {product_id} does not exist.')
+            if options['disable']:
+                if not inventory.unshard(product_id):
+                    raise CommandError(f'Product {product_id} still has pending reservations.')
+                self.stdout.write(f'Product {product_id} no longer uses inventory shards.')
+            else:
+                inventory.rebalance(product_id, shards=options['shards'])
+                self.stdout.write(f'Product {product_id} now uses {options["shards"]} inventory shards.')
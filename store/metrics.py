@@ -0,0 +1,196 @@
+"""
+Per-route request metrics in the Prometheus text format.
+
+MetricsMiddleware records, for every request, its latency in a histogram
+and the number and total time of its SQL queries, keyed by the resolved
+URL name and method. Queries are timed by an execute wrapper installed on
+every database connection when it opens (see store.signals); it reports to
+the QueryTimer of the current request through a context variable, so it
+also sees queries that async views run in the sync thread pool. The cost
+per request is a few perf_counter() calls and one short lock. metrics_view
+serves the metrics, along with the stats of the in-process caches.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+_metrics_settings = getattr(settings, 'STORE_METRICS', {})
+BUCKETS = tuple(_metrics_settings.get('BUCKETS', (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)))
+ALLOWED_IPS = _metrics_settings.get('ALLOWED_IPS', ['127.0.0.1'])
+
+_current_timer = ContextVar('store_query_timer', default=None)
+
+
+class QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def time_query(execute, sql, params, many, context):
+    timer = _current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_query_timer(connection):
+    # First in the list: execute_wrapper() blocks pop the last wrapper on exit.
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, time_query)
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.query_duration = 0.0
+        self.statuses = {}
+
+    def copy(self):
+        metrics = RouteMetrics()
+        metrics.__dict__.update(self.__dict__, buckets=list(self.buckets), statuses=dict(self.statuses))
+        return metrics
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, method, status, duration, queries, query_duration):
+        with self._lock:
+            metrics = self._routes.get((route, method))
+            if metrics is None:
+                metrics = self._routes[(route, method)] = RouteMetrics()
+            metrics.buckets[bisect_left(BUCKETS, duration)] += 1
+            metrics.count += 1
+            metrics.duration += duration
+            metrics.queries += queries
+            metrics.query_duration += query_duration
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {key: metrics.copy() for key, metrics in self._routes.items()}
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+
+registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        token = _current_timer.set(timer)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_timer.reset(token)
+        self.observe(request, response, time.perf_counter() - started, timer)
+        return response
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        token = _current_timer.set(timer)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_timer.reset(token)
+        self.observe(request, response, time.perf_counter() - started, timer)
+        return response
+
+    def observe(self, request, response, duration, timer):
+        match = request.resolver_match
+        route = (match.view_name or match.route) if match else 'unmatched'
+        registry.observe(route, request.method, response.status_code, duration, timer.count, timer.duration)
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in labels.items())
+
+
+def render_metrics():
+    # Imported here, so loading the middleware doesn't pull in the rest of the app.
+    from .authentication import user_cache
+    from .backends import permission_cache
+    from .cache import response_cache
+    from .revocation import revocation_store
+
+    lines = [
+        '# HELP store_http_request_duration_seconds Request latency by route.',
+        '# TYPE store_http_request_duration_seconds histogram',
+    ]
+    routes = sorted(registry.snapshot().items())
+    for (route, method), metrics in routes:
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), metrics.buckets):
+            cumulative += count
+            lines.append('store_http_request_duration_seconds_bucket{%s} %d' % (
+                _labels(route=route, method=method, le=bound), cumulative))
+        labels = _labels(route=route, method=method)
+        lines.append('store_http_request_duration_seconds_sum{%s} %f' % (labels, metrics.duration))
+        lines.append('store_http_request_duration_seconds_count{%s} %d' % (labels, metrics.count))
+
+    lines += ['# HELP store_http_responses_total Responses by route and status code.',
+              '# TYPE store_http_responses_total counter']
+    for (route, method), metrics in routes:
+        for status, count in sorted(metrics.statuses.items()):
+            lines.append('store_http_responses_total{%s} %d' % (
+                _labels(route=route, method=method, status=status), count))
+
+    lines += ['# HELP store_db_queries_total SQL queries run by route.',
+              '# TYPE store_db_queries_total counter']
+    lines += ['store_db_queries_total{%s} %d' % (_labels(route=route, method=method), metrics.queries)
+              for (route, method), metrics in routes]
+    lines += ['# HELP store_db_query_duration_seconds_total Time spent in SQL queries by route.',
+              '# TYPE store_db_query_duration_seconds_total counter']
+    lines += ['store_db_query_duration_seconds_total{%s} %f' % (_labels(route=route, method=method), metrics.query_duration)
+              for (route, method), metrics in routes]
+
+    caches = {'response': response_cache, 'user': user_cache, 'permission': permission_cache}
+    for stat, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'), ('entries', 'gauge')):
+        name = f'store_cache_{stat}' + ('_total' if kind == 'counter' else '')
+        lines += [f'# TYPE {name} {kind}']
+        lines += ['%s{%s} %d' % (name, _labels(cache=cache_name), cache.stats()[stat])
+                  for cache_name, cache in caches.items()]
+    for stat, count in revocation_store.stats().items():
+        lines += [f'# TYPE store_token_revocation_{stat}_total counter',
+                  f'store_token_revocation_{stat}_total {count}']
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    if request.META.get('REMOTE_ADDR') not in ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,53 @@
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE store_product_fts USING fts5(title, description)",
+    "INSERT INTO store_product_fts (rowid, title, description) SELECT id, title, description FROM store_product",
+    """CREATE TRIGGER store_product_fts_insert AFTER INSERT ON store_product BEGIN
+        INSERT INTO store_product_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER store_product_fts_update AFTER UPDATE OF title, description ON store_product BEGIN
+        DELETE FROM store_product_fts WHERE rowid = old.id;
+        INSERT INTO store_product_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER store_product_fts_delete AFTER DELETE ON store_product BEGIN
+        DELETE FROM store_product_fts WHERE rowid = old.id;
+    END""",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS store_product_fts_insert",
+    "DROP TRIGGER IF EXISTS store_product_fts_update",
+    "DROP TRIGGER IF EXISTS store_product_fts_delete",
+    "DROP TABLE IF EXISTS store_product_fts",
+]
+
+MYSQL_FORWARD = [
+    "CREATE FULLTEXT INDEX store_product_fulltext ON store_product (title, description)",
+]
+
+MYSQL_BACKWARD = [
+    "DROP INDEX store_product_fulltext ON store_product",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_alter_customer_options'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARD, 'mysql': MYSQL_FORWARD}),
+            run({'sqlite': SQLITE_BACKWARD, 'mysql': MYSQL_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:09
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_product_count(apps, schema_editor):
+    Collection = apps.get_model('store', 'Collection')
+    Product = apps.get_model('store', 'Product')
+    counts = Product.objects.filter(collection=OuterRef('pk')) \
+        .order_by().values('collection').annotate(count=Count('id')).values('count')
+    Collection.objects.update(product_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_product_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:14
+
+import django.core.validators
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_collection_product_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.UUIDField(db_index=True, default=uuid.uuid4)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('confirmed', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_reservations', to='store.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InventoryShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('quantity', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_shards', to='store.product')),
+            ],
+            options={
+                'unique_together': {('product', 'shard')},
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_customer_order_stats(apps, schema_editor):
+    Customer = apps.get_model('store', 'Customer')
+    CustomerOrderStats = apps.get_model('store', 'CustomerOrderStats')
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    spend_field = models.DecimalField(max_digits=12, decimal_places=2)
+    orders = Order.objects.filter(customer=OuterRef('pk')).order_by().values('customer')
+    spend = OrderItem.objects.filter(order__customer=OuterRef('pk')) \
+        .order_by().values('order__customer') \
+        .annotate(total=Sum(F('quantity') * F('unit_price'), output_field=spend_field)).values('total')
+    rows = Customer.objects.annotate(
+        order_count=Coalesce(Subquery(orders.annotate(count=Count('id')).values('count')), 0),
+        lifetime_spend=Coalesce(Subquery(spend), Value(0), output_field=spend_field),
+        last_order_at=Subquery(orders.annotate(last=Max('placed_at')).values('last')),
+    ).values_list('pk', 'order_count', 'lifetime_spend', 'last_order_at')
+    CustomerOrderStats.objects.bulk_create(
+        (CustomerOrderStats(customer_id=pk, order_count=count, lifetime_spend=spend, last_order_at=last)
+         for pk, count, spend, last in rows.iterator(chunk_size=10000)),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_revoked_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerOrderStats',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='order_stats', serialize=False, to='store.customer')),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('lifetime_spend', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('last_order_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'customer order stats',
+            },
+        ),
+        migrations.RunPython(populate_customer_order_stats, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,17 @@
 from django.conf import settings
 from django.contrib import admin
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import Count, ExpressionWrapper, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
 from uuid import uuid4
 
 
+def total_price_field():
+    # Line and cart totals computed in SQL can exceed Product.unit_price's digits.
+    return models.DecimalField(max_digits=12, decimal_places=2)
+
+
 class Promotion(models.Model):
     description = models.CharField(max_length=255)
     discount = models.FloatField()
@@ -14,6 +21,7 @@ class Collection(models.Model):
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         'Product', on_delete=models.SET_NULL, null=True, related_name='+', blank=True)
+    product_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self) -> str:
         return self.title
@@ -35,6 +43,21 @@ class Product(models.Model):
     collection = models.ForeignKey(Collection, on_delete=models.PROTECT, related_name='products')
     promotions = models.ManyToManyField(Promotion, blank=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored collection so the post_save handler can move
+        # the product between collection counters.
+        instance._loaded_collection_id = instance.__dict__.get('collection_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Keeps the Collection.product_count update made in post_save in the
+        # same transaction as the product row.
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+        self._loaded_collection_id = self.collection_id
+
     def __str__(self) -> str:
         return self.title
 
@@ -90,6 +113,12 @@ class Order(models.Model):
         max_length=1, choices=PAYMENT_STATUS_CHOICES, default=PAYMENT_STATUS_PENDING)
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so a change of customer moves the order between stats.
+        instance._loaded_customer_id = instance.__dict__.get('customer_id')
+        return instance
 
     class Meta:
         permissions = [
@@ -102,6 +131,59 @@ class OrderItem(models.Model):
     quantity = models.PositiveSmallIntegerField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_order_id = instance.__dict__.get('order_id')
+        instance._loaded_quantity = instance.__dict__.get('quantity')
+        instance._loaded_unit_price = instance.__dict__.get('unit_price')
+        return instance
+
+
+class CustomerOrderStatsManager(models.Manager):
+    def add(self, customer_id, orders=0, spend=0, placed_at=None):
+        """Adds to the stats of a customer in one UPDATE, creating the row first if needed."""
+        changes = {'order_count': F('order_count') + orders, 'lifetime_spend': F('lifetime_spend') + spend}
+        if placed_at is not None:
+            changes['last_order_at'] = Greatest(Coalesce('last_order_at', Value(placed_at)), Value(placed_at))
+        if not self.filter(customer_id=customer_id).update(**changes):
+            self.bulk_create([self.model(customer_id=customer_id)], ignore_conflicts=True)
+            self.filter(customer_id=customer_id).update(**changes)
+
+    def refresh(self, customer_ids=None):
+        """Recomputes the stats of `customer_ids`, or of every customer, from the orders."""
+        customers = Customer.objects.all() if customer_ids is None else Customer.objects.filter(pk__in=customer_ids)
+        self.bulk_create([self.model(customer_id=customer_id) for customer_id in customers.values_list('pk', flat=True)],
+                         ignore_conflicts=True, batch_size=1000)
+
+        orders = Order.objects.filter(customer=OuterRef('customer')).order_by().values('customer')
+        spend = OrderItem.objects.filter(order__customer=OuterRef('customer')) \
+            .order_by().values('order__customer') \
+            .annotate(total=Sum(F('quantity') * F('unit_price'), output_field=total_price_field())) \
+            .values('total')
+        stats = self.all() if customer_ids is None else self.filter(customer_id__in=customer_ids)
+        return stats.update(
+            order_count=Coalesce(Subquery(orders.annotate(count=Count('id')).values('count')), 0),
+            lifetime_spend=Coalesce(Subquery(spend), Value(0), output_field=total_price_field()),
+            last_order_at=Subquery(orders.annotate(last=Max('placed_at')).values('last')),
+        )
+
+
+class CustomerOrderStats(models.Model):
+    """
+    Order totals per customer, kept up to date by store.signals and by
+    checkout. Rebuild it with the rebuild_customer_stats command after bulk
+    loads.
+    """
+    objects = CustomerOrderStatsManager()
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='order_stats')
+    order_count = models.PositiveIntegerField(default=0)
+    lifetime_spend = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    last_order_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'customer order stats'
+
 
 class Address(models.Model):
     street = models.CharField(max_length=255)
@@ -110,12 +192,73 @@ class Address(models.Model):
         Customer, on_delete=models.CASCADE)
 
 
+class CartQuerySet(models.QuerySet):
+    def with_total_price(self):
+        return self.annotate(total_price=Coalesce(
+            Sum(F('items__product__unit_price') * F('items__quantity'), output_field=total_price_field()),
+            Value(0, output_field=total_price_field())))
+
+
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CartQuerySet.as_manager()
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_total_price(self):
+        return self.annotate(total_price=ExpressionWrapper(
+            F('product__unit_price') * F('quantity'), output_field=total_price_field()))
+
+    def total_price(self):
+        return self.aggregate(total_price=Coalesce(
+            Sum(F('product__unit_price') * F('quantity'), output_field=total_price_field()),
+            Value(0, output_field=total_price_field())))['total_price']
+
+    def add(self, cart_id, product_id, quantity):
+        """
+        Inserts a cart line or adds `quantity` to the existing one in a
+        single statement, so concurrent adds of the same product neither
+        lose updates nor trip the (cart, product) unique constraint.
+        Raises IntegrityError if the cart or the product does not exist.
+        """
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        cart_id = self.model._meta.get_field('cart').get_db_prep_value(cart_id, connection)
+        params = [cart_id, product_id, quantity]
+
+        with transaction.atomic(using=self.db):
+            with connection.cursor() as cursor:
+                if connection.vendor in ('sqlite', 'postgresql'):
+                    cursor.execute(
+                        f'INSERT INTO {table} (cart_id, product_id, quantity) VALUES (%s, %s, %s) '
+                        f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {table}.quantity + excluded.quantity '
+                        f'RETURNING id, quantity', params)
+                    item_id, quantity = cursor.fetchone()
+                elif connection.vendor == 'mysql':
+                    # LAST_INSERT_ID(id) makes lastrowid point at the updated row too.
+                    cursor.execute(
+                        f'INSERT INTO {table} (cart_id, product_id, quantity) VALUES (%s, %s, %s) '
+                        f'ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id), quantity = quantity + VALUES(quantity)',
+                        params)
+                    item_id = cursor.lastrowid
+                    cursor.execute(f'SELECT quantity FROM {table} WHERE id = %s', [item_id])
+                    quantity, = cursor.fetchone()
+                else:
+                    item, created = self.get_or_create(
+                        cart_id=cart_id, product_id=product_id, defaults={'quantity': quantity})
+                    if not created:
+                        self.filter(pk=item.pk).update(quantity=F('quantity') + quantity)
+                        item.refresh_from_db(fields=['quantity'])
+                    return item
+
+        return self.model.from_db(self.db, ['id', 'cart_id', 'product_id', 'quantity'],
+                                  [item_id, cart_id, product_id, quantity])
+
 
 class CartItem(models.Model):
+    objects = CartItemQuerySet.as_manager()
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
@@ -124,8 +267,46 @@ class CartItem(models.Model):
         unique_together = [['cart', 'product']]
 
 
+class InventoryShard(models.Model):
+    """
+    One slice of a product's available stock. Reservations decrement a
+    single shard row, so checkouts of a hot product spread their row locks
+    over several rows instead of queueing on Product.inventory.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='inventory_shards')
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+
+    class Meta:
+        unique_together = [['product', 'shard']]
+
+
+class InventoryReservation(models.Model):
+    """
+    Stock taken from a shard and not yet settled into Product.inventory.
+    Pending reservations are released back to their shard once they expire.
+    """
+    token = models.UUIDField(default=uuid4, db_index=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='inventory_reservations')
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField()
+    confirmed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
     name = models.CharField(max_length=255)
     description = models.TextField()
-    date = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    date = models.DateTimeField(auto_now_add=True)
+
+
+class RevokedToken(models.Model):
+    """
+    A refresh token that was logged out or rotated. Rows can be purged once
+    `expires_at` has passed, since the token is rejected as expired anyway.
+    """
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(auto_now_add=True, db_index=True)
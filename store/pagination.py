@@ -1,4 +1,197 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 class DefaultPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset() for async views: counts and fetches the page with
+        the async ORM, then sets up `self.page` the same way, so
+        get_paginated_response() works unchanged.
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+
+        offset = (number - 1) * page_size
+        rows = [row async for row in queryset[offset:offset + page_size]]
+        self.page = paginator._get_page(rows, number, paginator)
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        return rows
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination that seeks on the full ordering instead of an offset.
+
+    The ordering comes from the view's OrderingFilter and is made unique by
+    appending `tie_breakers`, so the cursor stores one value per ordering
+    field and every page is a single indexed range query. The total count is
+    only computed when the client asks for it with `?count=true`.
+    """
+    page_size = 10
+    ordering = ('title',)
+    tie_breakers = ('title', 'id')
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_keyset_ordering(request, queryset, view)
+        self.reverse, position = self.decode_keyset_cursor(request)
+
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = queryset.count()
+
+        if self.reverse:
+            queryset = queryset.order_by(*[self._invert(field) for field in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.get_keyset_filter(position))
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > len(self.page)
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        if self.page:
+            self.next_position = self._get_keyset_position(self.page[-1])
+            self.previous_position = self._get_keyset_position(self.page[0])
+        else:
+            self.next_position = self.previous_position = position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_keyset_ordering(self, request, queryset, view):
+        ordering = list(self.get_ordering(request, queryset, view))
+        names = [field.lstrip('-') for field in ordering]
+        for field in self.tie_breakers:
+            if field not in names:
+                ordering.append(field)
+                names.append(field)
+        return tuple(ordering)
+
+    def get_keyset_filter(self, position):
+        # Builds (a > x) OR (a = x AND b > y) OR ... for the seek direction
+        # of every field, which matches a composite (a, b, ...) comparison.
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != self.reverse
+            lookup = '%s__%s' % (name, 'lt' if descending else 'gt')
+            condition |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        return condition
+
+    def decode_keyset_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return False, None
+
+        try:
+            tokens = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            reverse = bool(tokens.get('r', 0))
+            position = tokens['p']
+        except (TypeError, ValueError, KeyError, AttributeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, position
+
+    def encode_keyset_cursor(self, reverse, position):
+        tokens = {'p': position}
+        if reverse:
+            tokens['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(tokens, separators=(',', ':')).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_keyset_cursor(False, self.next_position)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_keyset_cursor(True, self.previous_position)
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties'] = {
+            'count': {'type': 'integer', 'example': 123},
+            **response_schema['properties'],
+        }
+        return response_schema
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append({
+            'name': self.count_query_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Include the total number of results.',
+            'schema': {'type': 'boolean'},
+        })
+        return parameters
+
+    def _get_keyset_position(self, instance):
+        position = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            position.append(value if isinstance(value, (int, str)) else str(value))
+        return position
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith('-') else '-' + field
@@ -8,8 +8,11 @@ class IsAdminOrReadOnly(permissions.BasePermission):
     
 
 class FullDjangoModelPermissions(permissions.DjangoModelPermissions):
-    def __init__(self) -> None:
-        self.perms_map['GET'] = ['%(app_label)s.view_%(model_name)s']
+    # A copy, so DjangoModelPermissions and its other subclasses keep GET open
+    perms_map = {
+        **permissions.DjangoModelPermissions.perms_map,
+        'GET': ['%(app_label)s.view_%(model_name)s'],
+    }
 
 
 class CanViewCsutomerHistoryPermission(permissions.BasePermission):
@@ -0,0 +1,158 @@
+"""
+Revoked refresh tokens.
+
+Revoked jtis are stored in the RevokedToken table and mirrored in an
+in-process Bloom filter. A token that is not in the filter was definitely
+never revoked, so refreshes only hit the database for the few tokens that
+are (or collide with) revoked ones. Each process pulls revocations made by
+other processes every SYNC_INTERVAL seconds and rebuilds its filter in a
+background thread every REBUILD_INTERVAL seconds, which also drops expired
+tokens from it. Until every process has pulled a revocation, it is also
+published in the shared cache, which answers for tokens the filter doesn't
+know yet. Expired rows are removed by the purge_revoked_tokens command.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import partial
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from .models import RevokedToken
+
+_revocation_settings = getattr(settings, 'JWT_REVOCATION', {})
+SYNC_INTERVAL = _revocation_settings.get('SYNC_INTERVAL', 5)
+REBUILD_INTERVAL = _revocation_settings.get('REBUILD_INTERVAL', 60 * 60)
+CAPACITY = _revocation_settings.get('CAPACITY', 1_000_000)
+ERROR_RATE = _revocation_settings.get('ERROR_RATE', 0.01)
+
+# Rows are pulled with an overlap so revocations committed late by other
+# processes are still picked up.
+SYNC_OVERLAP = timedelta(seconds=60)
+
+RECENTLY_REVOKED_KEY = 'store:revoked_token:{}'
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class RevocationStore:
+    def __init__(self, capacity=CAPACITY, error_rate=ERROR_RATE,
+                 sync_interval=SYNC_INTERVAL, rebuild_interval=REBUILD_INTERVAL):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.filter = None
+        self.checks = 0
+        self.database_checks = 0
+        self.false_positives = 0
+        self._synced_at = None
+        self._rebuilt_at = 0
+        self._last_sync = 0
+        self._rebuilding = False
+        self._lock = threading.RLock()
+
+    def revoke(self, token):
+        """Revokes a refresh token (a simplejwt Token instance)."""
+        jti = token[api_settings.JTI_CLAIM]
+        expires_at = datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc)
+        try:
+            RevokedToken.objects.create(jti=jti, expires_at=expires_at)
+        except IntegrityError:
+            pass
+        # Other processes only pull the row on their next sync; kept until
+        # every one of them has.
+        transaction.on_commit(partial(
+            cache.set, RECENTLY_REVOKED_KEY.format(jti), True,
+            timeout=self.sync_interval + SYNC_OVERLAP.total_seconds()))
+        self._refresh()
+        self.filter.add(jti)
+
+    def is_revoked(self, jti):
+        self._refresh()
+        self.checks += 1
+        if jti not in self.filter:
+            return bool(cache.get(RECENTLY_REVOKED_KEY.format(jti)))
+        self.database_checks += 1
+        revoked = RevokedToken.objects.filter(jti=jti).exists()
+        if not revoked:
+            self.false_positives += 1
+        return revoked
+
+    def stats(self):
+        return {
+            'checks': self.checks,
+            'database_checks': self.database_checks,
+            'false_positives': self.false_positives,
+        }
+
+    def _refresh(self):
+        if self.filter is None:
+            with self._lock:
+                if self.filter is None:
+                    self._rebuild()
+            return
+
+        now = time.monotonic()
+        if now - self._rebuilt_at >= self.rebuild_interval and not self._rebuilding:
+            # Keep answering from the current filter while the new one loads.
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+        if now - self._last_sync >= self.sync_interval:
+            with self._lock:
+                if time.monotonic() - self._last_sync >= self.sync_interval:
+                    self._sync()
+
+    def _rebuild_in_background(self):
+        try:
+            self._rebuild()
+        finally:
+            self._rebuilding = False
+            connection.close()
+
+    def _rebuild(self):
+        started_at = timezone.now()
+        live = RevokedToken.objects.filter(expires_at__gt=started_at)
+        bloom = BloomFilter(max(self.capacity, live.count() * 2), self.error_rate)
+        for jti in live.values_list('jti', flat=True).iterator(chunk_size=10000):
+            bloom.add(jti)
+        with self._lock:
+            self.filter = bloom
+            self._synced_at = started_at
+            self._rebuilt_at = time.monotonic()
+            # Pick up what was revoked while the filter was loading.
+            self._sync()
+
+    def _sync(self):
+        started_at = timezone.now()
+        recent = RevokedToken.objects.filter(revoked_at__gte=self._synced_at - SYNC_OVERLAP)
+        for jti in recent.values_list('jti', flat=True).iterator(chunk_size=10000):
+            self.filter.add(jti)
+        self._synced_at = started_at
+        self._last_sync = time.monotonic()
+
+
+revocation_store = RevocationStore()
@@ -0,0 +1,145 @@
+"""
+Read-replica routing.
+
+ReplicaRoutingMiddleware marks GET and HEAD requests served by the store
+views, and ReplicaRouter sends their reads to one of the aliases listed in
+STORE_DB_REPLICAS['ALIASES']. Everything else uses the primary ('default'):
+writes, reads inside a transaction, reads after the request has written,
+reads after read_from_primary() was called, and requests from a client that
+wrote less than STICKY_SECONDS ago (tracked with a cookie), so clients
+always read their own writes. A replica that can't be reached is skipped
+for RETRY_AFTER seconds.
+"""
+import random
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+_replica_settings = getattr(settings, 'STORE_DB_REPLICAS', {})
+REPLICAS = list(_replica_settings.get('ALIASES', []))
+STICKY_SECONDS = _replica_settings.get('STICKY_SECONDS', 5)
+RETRY_AFTER = _replica_settings.get('RETRY_AFTER', 30)
+STICKY_COOKIE_NAME = _replica_settings.get('COOKIE_NAME', 'store_primary_until')
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+_request_state = ContextVar('store_replica_routing', default=None)
+_unavailable_until = {}
+
+
+class RoutingState:
+    def __init__(self, request):
+        self.request = request
+        self.wrote = False
+        self.primary = False
+        self.replica = None
+        self._store_view = None
+
+    def reads_from_replica(self):
+        if self.wrote or self.primary or self.request.method not in SAFE_METHODS:
+            return False
+        if self._store_view is None:
+            match = self.request.resolver_match
+            view = getattr(match.func, 'cls', match.func) if match else None
+            self._store_view = view is not None and view.__module__.startswith('store.')
+        if not self._store_view:
+            return False
+        try:
+            return float(self.request.COOKIES.get(STICKY_COOKIE_NAME, 0)) < time.time()
+        except ValueError:
+            return True
+
+
+def available_replica():
+    """Returns a reachable replica alias at random, or None."""
+    now = time.monotonic()
+    for alias in random.sample(REPLICAS, len(REPLICAS)):
+        if _unavailable_until.get(alias, 0) > now:
+            continue
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            _unavailable_until[alias] = now + RETRY_AFTER
+            continue
+        return alias
+    return None
+
+
+def read_from_primary():
+    """
+    Sends the remaining reads of the current request to the primary. Used
+    for data that is cached or validated under the current catalog version,
+    which a lagging replica may not have caught up with yet.
+    """
+    state = _request_state.get()
+    if state is not None:
+        state.primary = True
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if state is None or not REPLICAS or not state.reads_from_replica():
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        # Every read of a request goes to the same replica.
+        if state.replica is None:
+            state.replica = available_replica() or DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in REPLICAS
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Tracks each request for ReplicaRouter and, after a request that wrote,
+    sets the cookie that keeps the client on the primary for a while.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState(request)
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self.set_sticky_cookie(state, response)
+
+    async def __acall__(self, request):
+        state = RoutingState(request)
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self.set_sticky_cookie(state, response)
+
+    def set_sticky_cookie(self, state, response):
+        if state.wrote and REPLICAS:
+            response.set_cookie(STICKY_COOKIE_NAME, str(time.time() + STICKY_SECONDS),
+                                max_age=STICKY_SECONDS, httponly=True, samesite='Lax')
+        return response
+
@@ -0,0 +1,199 @@
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, FloatField, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework.filters import SearchFilter
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class BaseSearchBackend:
+    """
+    A search backend filters a queryset down to the rows matching every
+    search term (as a prefix) and orders them by relevance, best first.
+    """
+    def search(self, queryset, fields, terms):
+        raise NotImplementedError
+
+    def index(self, instance):
+        """Called after a model instance is saved."""
+
+    def remove(self, instance):
+        """Called after a model instance is deleted."""
+
+
+class MySQLFullTextBackend(BaseSearchBackend):
+    """
+    Uses the FULLTEXT index created by the `product_search_index` migration.
+    InnoDB keeps the index up to date on every write.
+    """
+    def search(self, queryset, fields, terms):
+        table = queryset.model._meta.db_table
+        columns = ', '.join(
+            '%s.%s' % (connection.ops.quote_name(table), connection.ops.quote_name(field))
+            for field in fields)
+        query = ' '.join('+%s*' % term for term in terms)
+        rank = RawSQL('MATCH (%s) AGAINST (%%s IN BOOLEAN MODE)' % columns, [query])
+        return queryset.annotate(search_rank=rank) \
+            .filter(search_rank__gt=0) \
+            .order_by('-search_rank')
+
+
+class SQLiteFTS5Backend(BaseSearchBackend):
+    """
+    Uses the `<table>_fts` FTS5 table created by the `product_search_index`
+    migration. Database triggers keep it in sync with the model table.
+    """
+    def search(self, queryset, fields, terms):
+        table = queryset.model._meta.db_table
+        fts_table = connection.ops.quote_name(table + '_fts')
+        query = ' '.join('"%s"*' % term for term in terms)
+        rank = RawSQL(
+            'SELECT bm25(%s) FROM %s WHERE %s MATCH %%s AND rowid = %s.%s' % (
+                fts_table, fts_table, fts_table,
+                connection.ops.quote_name(table), connection.ops.quote_name('id')),
+            [query])
+        matches = RawSQL('SELECT rowid FROM %s WHERE %s MATCH %%s' % (fts_table, fts_table), [query])
+        # bm25() is negative, the best match has the lowest score.
+        return queryset.filter(id__in=matches) \
+            .annotate(search_rank=rank) \
+            .order_by('search_rank')
+
+
+class InMemorySearchBackend(BaseSearchBackend):
+    """
+    A process-local inverted index for local testing on databases without a
+    full-text engine. It is built on first use and maintained from the
+    Product save/delete signals, so it does not see bulk writes made by
+    other processes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def search(self, queryset, fields, terms):
+        index = self._get_index(queryset.model, fields)
+        scores = defaultdict(float)
+        matched = None
+        with self._lock:
+            total = max(len(index['documents']), 1)
+            for term in terms:
+                term_scores = defaultdict(float)
+                vocabulary = index['vocabulary']
+                position = bisect_left(vocabulary, term)
+                while position < len(vocabulary) and vocabulary[position].startswith(term):
+                    postings = index['postings'][vocabulary[position]]
+                    idf = math.log(1 + total / len(postings))
+                    for pk, frequency in postings.items():
+                        term_scores[pk] += frequency * idf
+                    position += 1
+                matched = set(term_scores) if matched is None else matched & set(term_scores)
+                for pk, score in term_scores.items():
+                    scores[pk] += score
+
+        if not matched:
+            return queryset.none()
+        ranked = sorted(matched, key=lambda pk: (-scores[pk], pk))
+        rank = Case(
+            *[When(pk=pk, then=Value(float(position))) for position, pk in enumerate(ranked)],
+            output_field=FloatField())
+        return queryset.filter(pk__in=ranked) \
+            .annotate(search_rank=rank) \
+            .order_by('search_rank')
+
+    def index(self, instance):
+        with self._lock:
+            index = self._indexes.get(type(instance))
+            if index is None:
+                return
+            self._remove_document(index, instance.pk)
+            self._add_document(index, instance.pk, [getattr(instance, field) for field in index['fields']])
+
+    def remove(self, instance):
+        with self._lock:
+            index = self._indexes.get(type(instance))
+            if index is not None:
+                self._remove_document(index, instance.pk)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+    def _get_index(self, model, fields):
+        fields = tuple(fields)
+        with self._lock:
+            index = self._indexes.get(model)
+            if index is not None and index['fields'] == fields:
+                return index
+
+        index = {'fields': fields, 'documents': {}, 'postings': defaultdict(dict), 'vocabulary': []}
+        rows = model._default_manager.values_list('pk', *fields).iterator(chunk_size=2000)
+        for pk, *values in rows:
+            self._add_document(index, pk, values, sort=False)
+        index['vocabulary'] = sorted(index['postings'])
+
+        with self._lock:
+            self._indexes[model] = index
+        return index
+
+    def _add_document(self, index, pk, values, sort=True):
+        frequencies = defaultdict(int)
+        for value in values:
+            for token in tokenize(value):
+                frequencies[token] += 1
+        index['documents'][pk] = list(frequencies)
+        for token, frequency in frequencies.items():
+            if sort and token not in index['postings']:
+                index['vocabulary'].insert(bisect_left(index['vocabulary'], token), token)
+            index['postings'][token][pk] = frequency
+
+    def _remove_document(self, index, pk):
+        for token in index['documents'].pop(pk, []):
+            postings = index['postings'][token]
+            postings.pop(pk, None)
+            if not postings:
+                del index['postings'][token]
+                index['vocabulary'].pop(bisect_left(index['vocabulary'], token))
+
+
+_backends = {}
+
+
+def get_search_backend():
+    """
+    Returns the backend named by the STORE_SEARCH_BACKEND setting, or the
+    one matching the default database engine.
+    """
+    path = getattr(settings, 'STORE_SEARCH_BACKEND', None)
+    if path is None:
+        path = {
+            'mysql': 'store.search.MySQLFullTextBackend',
+            'sqlite': 'store.search.SQLiteFTS5Backend',
+        }.get(connection.vendor, 'store.search.InMemorySearchBackend')
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    Drop-in replacement for SearchFilter that searches through the
+    configured full-text backend instead of ILIKE '%term%' chains and
+    returns results ranked by relevance.
+    """
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        terms = [token for term in self.get_search_terms(request) for token in tokenize(term)]
+        if not search_fields or not terms:
+            return queryset
+        return get_search_backend().search(queryset, search_fields, terms)
@@ -1,6 +1,20 @@
 from decimal import Decimal
+from functools import lru_cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Product, Collection, Review, Cart, CartItem, Order, OrderItem, Customer
+from rest_framework.exceptions import NotFound
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from likes.models import LikeCount, LikedItem
+from tags.models import TaggedItem
+from . import inventory
+from .cache import bump_catalog_version
+from .revocation import revocation_store
+from .models import Product, Collection, Review, Cart, CartItem, Order, OrderItem, Customer, CustomerOrderStats
 
 class CollectionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -14,15 +28,80 @@ class SimpleProductSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'unit_price']
     
 
+TAX_RATE = Decimal(1.1)
+
+
+@lru_cache(maxsize=4096)
+def price_with_tax(unit_price: Decimal) -> Decimal:
+    # Catalogs reuse a small set of prices, so each product is a cache hit.
+    return unit_price * TAX_RATE
+
+
+def product_extras(product_ids, context):
+    """
+    Returns {product_id: extra fields} for the opt-in fields requested in
+    the serializer context (see ProductViewSet.get_serializer_context),
+    with one query per kind of field whatever the number of products.
+    Returns {} when none are requested.
+    """
+    if not (context.get('include_tags') or context.get('include_likes')):
+        return {}
+    extras = {product_id: {} for product_id in product_ids}
+    if context.get('include_tags'):
+        tags = TaggedItem.objects.get_tags_for_many(Product, product_ids)
+        for product_id, fields in extras.items():
+            fields['tags'] = tags[product_id]
+    if context.get('include_likes'):
+        counts = LikeCount.objects.counts_for(Product, product_ids)
+        liked = LikedItem.objects.liked_by(context['request'].user, Product, product_ids)
+        for product_id, fields in extras.items():
+            fields['likes'] = counts[product_id]
+            fields['liked'] = product_id in liked
+    return extras
+
+
+class ProductExtrasListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        products = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        # Loaded for the whole list instead of once per product.
+        self.context['product_extras'] = product_extras([product.id for product in products], self.context)
+        return super().to_representation(products)
+
+
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ['id', 'title', 'slug', 'description', 'inventory' ,'unit_price', 'price_with_tax', 'collection']
+        fields = ['id', 'title', 'slug', 'description', 'inventory', 'available_inventory', 'unit_price',
+                  'price_with_tax', 'collection']
+        list_serializer_class = ProductExtrasListSerializer
     price_with_tax = serializers.SerializerMethodField(method_name="calc_tax")
-
+    # Products with inventory shards can sell less than `inventory`, which
+    # still holds their outstanding reservations (see store.inventory).
+    available_inventory = serializers.SerializerMethodField()
 
     def calc_tax(self, prodcut: Product):
-        return prodcut.unit_price * Decimal(1.1)  
+        return price_with_tax(prodcut.unit_price)
+
+    def get_available_inventory(self, product: Product):
+        # The views annotate it; products just created or saved are looked up.
+        if hasattr(product, 'available_inventory'):
+            return product.available_inventory
+        return Product.objects.filter(pk=product.pk) \
+            .annotate(available=inventory.available_inventory()).values_list('available', flat=True).get()
+
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        # Saving rebalanced the shards, so the annotated stock is stale.
+        instance.__dict__.pop('available_inventory', None)
+        return instance
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        extras = self.context.get('product_extras')
+        if extras is None:
+            extras = product_extras([instance.id], self.context)
+        data.update(extras.get(instance.id, {}))
+        return data
 
     # def create(self, validated_data):
     #     product = Product(**validated_data)
@@ -35,6 +114,43 @@ class ProductSerializer(serializers.ModelSerializer):
     #     instance.save()
     #     return instance
 
+class ProductListSerializer:
+    """
+    Read-only fast path for product lists. It works on `values()` rows
+    instead of model instances and builds the same data as
+    ProductSerializer(many=True), without DRF's per-field machinery.
+    """
+    # last_update is only fetched so keyset pagination can read it.
+    value_fields = ['id', 'title', 'slug', 'description', 'inventory', 'available_inventory',
+                    'unit_price', 'collection_id', 'last_update']
+    price_quantum = Decimal('0.01')
+
+    def __init__(self, rows, context=None):
+        self.rows = rows
+        self.context = context or {}
+
+    def to_representation(self, row):
+        return {
+            'id': row['id'],
+            'title': row['title'],
+            'slug': row['slug'],
+            'description': row['description'],
+            'inventory': row['inventory'],
+            'available_inventory': row.get('available_inventory', row['inventory']),
+            'unit_price': row['unit_price'].quantize(self.price_quantum),
+            'price_with_tax': price_with_tax(row['unit_price']),
+            'collection': row['collection_id'],
+        }
+
+    @property
+    def data(self):
+        rows = list(self.rows)
+        extras = product_extras([row['id'] for row in rows], self.context)
+        if not extras:
+            return [self.to_representation(row) for row in rows]
+        return [dict(self.to_representation(row), **extras[row['id']]) for row in rows]
+
+
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
@@ -48,30 +164,93 @@ class ReviewSerializer(serializers.ModelSerializer):
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError("No product with the given ID was found.")
-        return value
-
     def save(self, **kwargs):
         cart_id = self.context['cart_id']
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
 
+        # The product is checked by the foreign key instead of a separate
+        # exists() query; the lookups below only run on the error path.
         try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
-            
+            self.instance = CartItem.objects.add(cart_id, product_id, quantity)
+        except IntegrityError:
+            if not Product.objects.filter(pk=product_id).exists():
+                raise serializers.ValidationError({'product_id': ["No product with the given ID was found."]})
+            if not Cart.objects.filter(pk=cart_id).exists():
+                raise NotFound("No cart with the given ID was found.")
+            raise
+
         return self.instance
     
     class Meta:
         model = CartItem
         fields = ['id', 'product_id', 'quantity']
 
+class BulkCartLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, max_value=32767)
+
+
+class BulkCartItemSerializer(serializers.Serializer):
+    """
+    Sets the quantity of many cart lines at once. A quantity of 0 removes
+    the line, and `replace` removes every line that is not listed.
+    """
+    items = BulkCartLineSerializer(many=True)
+    replace = serializers.BooleanField(default=False)
+
+    def validate_items(self, items):
+        product_ids = [item['product_id'] for item in items]
+        if len(set(product_ids)) != len(product_ids):
+            raise serializers.ValidationError("Each product can only be listed once.")
+        found = set(Product.objects.filter(pk__in=product_ids).values_list('id', flat=True))
+        missing = sorted(set(product_ids) - found)
+        if missing:
+            raise serializers.ValidationError(f"No product was found for the IDs {missing}.")
+        return items
+
+    def save(self, **kwargs):
+        cart_id = self.context['cart_id']
+        items = self.validated_data['items']
+        quantities = {item['product_id']: item['quantity'] for item in items}
+
+        with transaction.atomic():
+            # Locking the cart row serializes concurrent syncs of one cart.
+            try:
+                found = Cart.objects.select_for_update().filter(pk=cart_id).exists()
+            except ValidationError:
+                found = False
+            if not found:
+                raise NotFound("No cart with the given ID was found.")
+
+            lines = CartItem.objects.filter(cart_id=cart_id)
+            if self.validated_data['replace']:
+                lines.exclude(product_id__in=[pk for pk, quantity in quantities.items() if quantity]).delete()
+            else:
+                lines.filter(product_id__in=[pk for pk, quantity in quantities.items() if not quantity]).delete()
+
+            existing = {item.product_id: item for item in lines.filter(product_id__in=quantities)}
+            to_create, to_update = [], []
+            for product_id, quantity in quantities.items():
+                if not quantity:
+                    continue
+                item = existing.get(product_id)
+                if item is None:
+                    to_create.append(CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity))
+                elif item.quantity != quantity:
+                    item.quantity = quantity
+                    to_update.append(item)
+
+            # CartItem.objects.add() doesn't take the cart lock, so a line
+            # may have been added since it was looked up.
+            CartItem.objects.bulk_create(
+                to_create, update_conflicts=True, update_fields=['quantity'],
+                unique_fields=['cart', 'product'] if connection.features.supports_update_conflicts_with_target else None)
+            CartItem.objects.bulk_update(to_update, ['quantity'])
+
+        return cart_id
+
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     # product_id = serializers.IntegerField(read)
     class Meta:
@@ -83,6 +262,9 @@ class CartItemSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField(method_name='get_total_price')
 
     def get_total_price(self, cart_item: CartItem):
+        # Annotated by CartItemQuerySet.with_total_price()
+        if hasattr(cart_item, 'total_price'):
+            return cart_item.total_price
         return cart_item.product.unit_price * cart_item.quantity
     class Meta:
         model = CartItem
@@ -94,11 +276,20 @@ class CartSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField(method_name='get_total_price')
     
     def get_total_price(self, cart: Cart):
+        # Annotated by CartQuerySet.with_total_price()
+        if hasattr(cart, 'total_price'):
+            return cart.total_price
         return sum([item.product.unit_price * item.quantity for item in cart.items.all()])
     class Meta:
         model = Cart
         fields = ['id', 'items', 'total_price']
 
+    def create(self, validated_data):
+        cart = super().create(validated_data)
+        # A new cart has no lines, no need to query them for the total.
+        cart.total_price = 0
+        return cart
+
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer(many=True)
@@ -112,8 +303,98 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ['id', 'customer']
 
+class CheckoutSerializer(serializers.Serializer):
+    """
+    Turns a cart into an order in one transaction. Product rows are locked
+    in primary key order so concurrent checkouts sharing products always
+    acquire their locks in the same order and cannot deadlock. Products
+    with inventory shards are reserved through store.inventory instead.
+    """
+    cart_id = serializers.UUIDField()
+
+    def save(self, **kwargs):
+        cart_id = self.validated_data['cart_id']
+
+        with transaction.atomic():
+            if not Cart.objects.select_for_update().filter(pk=cart_id).exists():
+                raise NotFound("No cart with the given ID was found.")
+
+            quantities = dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'))
+            if not quantities:
+                raise serializers.ValidationError({'cart_id': ["The cart is empty."]})
+
+            # Products with inventory shards are reserved from a shard
+            # instead of locking the product row.
+            sharded = inventory.sharded_product_ids(quantities)
+            locked = Product.objects.select_for_update().filter(pk__in=set(quantities) - sharded).order_by('pk')
+            products = list(locked.only('id', 'unit_price', 'inventory'))
+            if sharded:
+                products += Product.objects.filter(pk__in=sharded).only('id', 'unit_price')
+            out_of_stock = [product.id for product in products
+                            if product.id not in sharded and product.inventory < quantities[product.id]]
+            for product_id in sorted(sharded):
+                try:
+                    inventory.reserve(product_id, quantities[product_id], confirmed=True)
+                except inventory.InsufficientInventory:
+                    out_of_stock.append(product_id)
+            if out_of_stock:
+                raise serializers.ValidationError(
+                    {'cart_id': [f"Not enough inventory for the products {sorted(out_of_stock)}."]})
+
+            if len(sharded) < len(quantities):
+                Product.objects.filter(pk__in=set(quantities) - sharded).update(inventory=Case(
+                    *[When(pk=product_id, then=F('inventory') - quantity)
+                      for product_id, quantity in quantities.items() if product_id not in sharded],
+                    output_field=models.IntegerField()), last_update=timezone.now())
+
+            customer, created = Customer.objects.get_or_create(user_id=self.context['user_id'])
+            order = Order(customer=customer)
+            order._count_stats = False
+            order.save()
+            items = OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=product.id, quantity=quantities[product.id],
+                          unit_price=product.unit_price)
+                for product in products
+            ])
+            # bulk_create skips the OrderItem signals that track spend, so the
+            # order and its total are counted here in a single UPDATE.
+            CustomerOrderStats.objects.add(customer.id, orders=1, placed_at=order.placed_at,
+                                           spend=sum(item.quantity * item.unit_price for item in items))
+            Cart.objects.filter(pk=cart_id).delete()
+
+        # The inventory update bypasses the Product signals.
+        bump_catalog_version()
+        self.instance = order
+        return order
+
+
 class CustomerSerializer(serializers.ModelSerializer):
     user_id = serializers.IntegerField()
     class Meta:
         model = Customer
-        fields = ['id', 'user_id', 'phone', 'birth_date', 'membership']
\ No newline at end of file
+        fields = ['id', 'user_id', 'phone', 'birth_date', 'membership']
+
+
+class CustomerOrderStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomerOrderStats
+        fields = ['order_count', 'lifetime_spend', 'last_order_at']
+
+
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Rejects refresh tokens found in the revocation store, and revokes the
+    presented token when it is rotated.
+    """
+    revocation_store = revocation_store
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if self.revocation_store.is_revoked(refresh[jwt_settings.JTI_CLAIM]):
+            raise InvalidToken('Token is blacklisted')
+
+        data = super().validate(attrs)
+
+        if jwt_settings.ROTATE_REFRESH_TOKENS and jwt_settings.BLACKLIST_AFTER_ROTATION:
+            self.revocation_store.revoke(refresh)
+        return data
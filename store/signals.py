@@ -0,0 +1,153 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from tags.models import Tag, TaggedItem
+from . import inventory, metrics
+from .authentication import bump_user_version
+from .backends import bump_permission_version
+from .cache import bump_catalog_version
+from .models import Product, Collection, Promotion, InventoryShard, CustomerOrderStats, Order, OrderItem
+from .search import get_search_backend
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    metrics.install_query_timer(connection)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    get_search_backend().index(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove(instance)
+
+
+@receiver(pre_save, sender=Product)
+def load_product_collection(sender, instance, raw=False, **kwargs):
+    # Instances built without from_db() don't know their stored collection.
+    if not raw and instance.pk is not None and not hasattr(instance, '_loaded_collection_id'):
+        instance._loaded_collection_id = Product.objects.filter(pk=instance.pk) \
+            .values_list('collection_id', flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else getattr(instance, '_loaded_collection_id', None)
+    if previous == instance.collection_id:
+        return
+    if previous is not None:
+        Collection.objects.filter(pk=previous, product_count__gt=0).update(product_count=F('product_count') - 1)
+    Collection.objects.filter(pk=instance.collection_id).update(product_count=F('product_count') + 1)
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, instance, **kwargs):
+    Collection.objects.filter(pk=instance.collection_id, product_count__gt=0).update(product_count=F('product_count') - 1)
+
+
+@receiver(post_save, sender=Product)
+def rebalance_inventory_shards(sender, instance, created, raw=False, **kwargs):
+    # Spread restocks made by editing Product.inventory over the shards.
+    if not raw and not created and InventoryShard.objects.filter(product=instance).exists():
+        inventory.rebalance(instance.pk)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user(sender, instance, **kwargs):
+    bump_user_version(str(instance.pk))
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+@receiver(m2m_changed, sender=get_user_model().user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def invalidate_permissions(sender, **kwargs):
+    bump_permission_version()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+@receiver(m2m_changed, sender=Product.promotions.through)
+def invalidate_catalog(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=TaggedItem)
+@receiver(post_delete, sender=TaggedItem)
+def invalidate_tagged_product(sender, instance, **kwargs):
+    # Product responses embed their tags with ?include=tags.
+    if instance.content_type_id == ContentType.objects.get_for_model(Product).id:
+        bump_catalog_version()
+
+
+@receiver(post_save, sender=Tag)
+def invalidate_tag_label(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Order)
+def count_saved_order(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        # Checkout adds the order together with its lines.
+        if getattr(instance, '_count_stats', True):
+            CustomerOrderStats.objects.add(instance.customer_id, orders=1, placed_at=instance.placed_at)
+        return
+    previous = getattr(instance, '_loaded_customer_id', instance.customer_id)
+    if previous != instance.customer_id:
+        CustomerOrderStats.objects.refresh([previous, instance.customer_id])
+    instance._loaded_customer_id = instance.customer_id
+
+
+@receiver(post_delete, sender=Order)
+def count_deleted_order(sender, instance, **kwargs):
+    CustomerOrderStats.objects.refresh([instance.customer_id])
+
+
+@receiver(post_save, sender=OrderItem)
+def count_saved_order_item(sender, instance, created, raw=False, **kwargs):
+    # Checkout bulk-creates its lines and adds their total itself.
+    if raw:
+        return
+    if created:
+        customer_id = Order.objects.filter(pk=instance.order_id).values_list('customer_id', flat=True).get()
+        CustomerOrderStats.objects.add(customer_id, spend=instance.quantity * instance.unit_price)
+    elif getattr(instance, '_loaded_order_id', None) != instance.order_id:
+        # Moved to another order, or built without from_db(): recompute.
+        order_ids = {getattr(instance, '_loaded_order_id', None), instance.order_id} - {None}
+        CustomerOrderStats.objects.refresh(Order.objects.filter(pk__in=order_ids).values('customer_id'))
+    else:
+        previous = (instance._loaded_quantity, instance._loaded_unit_price)
+        current = (instance.quantity, instance.unit_price)
+        if None in previous:
+            CustomerOrderStats.objects.refresh(Order.objects.filter(pk=instance.order_id).values('customer_id'))
+        elif previous != current:
+            customer_id = Order.objects.filter(pk=instance.order_id).values_list('customer_id', flat=True).get()
+            CustomerOrderStats.objects.add(customer_id, spend=current[0] * current[1] - previous[0] * previous[1])
+    instance._loaded_order_id = instance.order_id
+    instance._loaded_quantity = instance.quantity
+    instance._loaded_unit_price = instance.unit_price
+
+
+@receiver(post_delete, sender=OrderItem)
+def count_deleted_order_item(sender, instance, **kwargs):
+    customer_id = Order.objects.filter(pk=instance.order_id).values_list('customer_id', flat=True).first()
+    if customer_id is not None:
+        CustomerOrderStats.objects.add(customer_id, spend=-instance.quantity * instance.unit_price)
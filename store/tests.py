@@ -1,3 +1,1053 @@
-from django.test import TestCase
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Barrier, Thread
+from unittest import mock, skipIf
+from uuid import uuid4
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve, reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from likes.buffer import like_buffer
+from likes.models import LikeCount, LikedItem
+from tags.models import Tag, TaggedItem
+from . import inventory, routers
+from .authentication import get_user_version, user_cache
+from .backends import get_permission_version, permission_cache
+from .cache import get_catalog_version, response_cache
+from .management.commands.import_catalog import REPORTED_ERRORS
+from .models import (Cart, CartItem, Collection, Customer, CustomerOrderStats, InventoryReservation, InventoryShard,
+                     Order, OrderItem, Product, Review)
+from .revocation import RevocationStore, revocation_store
+from .search import get_search_backend
+from .serializers import ProductListSerializer, ProductSerializer
+from .views import ProductViewSet
 
-# Create your tests here.
+
+class EndpointQueryCountTests(APITestCase):
+    """
+    Every route in store/urls.py must run the same number of queries however
+    many rows it returns. Each check runs once, grows the data set and runs
+    again; on failure assertNumQueries lists the SQL that was run.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.customer = Customer.objects.create(user=cls.admin, phone='555-0100')
+        cls.collection = Collection.objects.create(title='Collection')
+        cls.product = cls.create_product('Product')
+        cls.cart = Cart.objects.create()
+        cls.order = Order.objects.create(customer=cls.customer)
+
+    @classmethod
+    def create_product(cls, title, collection=None):
+        return Product.objects.create(
+            title=title, slug=title.lower(), unit_price=10, inventory=1000,
+            collection=collection or cls.collection)
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+        self.grown = 0
+
+    def grow(self, size):
+        """Adds `size` rows behind every route."""
+        for n in range(self.grown, self.grown + size):
+            collection = Collection.objects.create(title=f'Collection {n}')
+            product = self.create_product(f'Product {n}', collection)
+            tag = Tag.objects.create(label=f'Tag {n}')
+            TaggedItem.objects.create(tag=tag, content_object=product)
+            TaggedItem.objects.create(tag=tag, content_object=self.product)
+            Review.objects.create(product=self.product, name=f'Reviewer {n}', description='Good')
+            CartItem.objects.create(cart=self.cart, product=product, quantity=1)
+            user = get_user_model().objects.create(username=f'user{n}', email=f'user{n}@example.com')
+            customer = Customer.objects.create(user=user, phone='555-0101')
+            LikedItem.objects.create(user=user, content_object=product)
+            LikedItem.objects.create(user=self.admin, content_object=product)
+            order = Order.objects.create(customer=customer)
+            OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=10)
+        self.grown += size
+
+    def clear_caches(self):
+        response_cache.clear()
+        user_cache.clear()
+        permission_cache.clear()
+
+    def assertConstantQueries(self, expected, method, url, data=None):
+        for size in (1, 10):
+            self.grow(size)
+            self.clear_caches()
+            with self.subTest(url=url, rows=self.grown):
+                with self.assertNumQueries(expected):
+                    response = getattr(self.client, method)(url, data, format='json')
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                self.assertLess(response.status_code, 400, getattr(response, 'data', None))
+
+    def test_api_root(self):
+        self.assertConstantQueries(0, 'get', reverse('api-root'))
+
+    def test_product_list(self):
+        self.assertConstantQueries(2, 'get', reverse('product-list'))
+
+    def test_product_list_filtered_and_searched(self):
+        url = reverse('product-list') + f'?collection_id={self.collection.id}&search=product&ordering=-unit_price'
+        # django-filter looks the collection up to validate collection_id.
+        self.assertConstantQueries(3, 'get', url)
+
+    def test_product_list_keyset(self):
+        self.assertConstantQueries(1, 'get', reverse('product-list') + '?pagination=cursor')
+
+    def test_product_list_with_tags(self):
+        self.assertConstantQueries(3, 'get', reverse('product-list') + '?include=tags')
+
+    def test_product_list_with_likes(self):
+        self.assertConstantQueries(4, 'get', reverse('product-list') + '?include=likes')
+
+    def test_product_detail(self):
+        self.assertConstantQueries(2, 'get', reverse('product-detail', args=[self.product.id]))
+
+    def test_product_detail_with_tags(self):
+        self.assertConstantQueries(3, 'get', reverse('product-detail', args=[self.product.id]) + '?include=tags')
+
+    def test_product_detail_with_likes(self):
+        self.assertConstantQueries(3, 'get', reverse('product-detail', args=[self.product.id]) + '?include=likes')
+
+    def test_product_export(self):
+        self.assertConstantQueries(1, 'get', reverse('product-export') + '?export_format=csv')
+
+    def test_product_like(self):
+        with TemporaryDirectory() as directory, \
+                mock.patch.object(like_buffer, 'directory', Path(directory)), \
+                mock.patch.object(like_buffer, 'flush_interval', None):
+            # Likes are only buffered; the flush writes them.
+            self.assertConstantQueries(1, 'post', reverse('product-like', args=[self.product.id]))
+            like_buffer.flush()
+        self.assertEqual(LikeCount.objects.counts_for(Product, [self.product.id])[self.product.id], 1)
+
+    def test_product_reviews(self):
+        self.assertConstantQueries(1, 'get', reverse('product-reviews-list', args=[self.product.id]))
+
+    def test_product_review_detail(self):
+        review = Review.objects.create(product=self.product, name='Reviewer', description='Good')
+        self.assertConstantQueries(1, 'get', reverse('product-reviews-detail', args=[self.product.id, review.id]))
+
+    def test_collection_list(self):
+        self.assertConstantQueries(1, 'get', reverse('collection-list'))
+
+    def test_collection_detail(self):
+        self.assertConstantQueries(1, 'get', reverse('collection-detail', args=[self.collection.id]))
+
+    def test_cart_create(self):
+        self.assertConstantQueries(2, 'post', reverse('cart-list'))
+
+    def test_cart_detail(self):
+        self.assertConstantQueries(3, 'get', reverse('cart-detail', args=[self.cart.id]))
+
+    def test_cart_items(self):
+        self.assertConstantQueries(2, 'get', reverse('cart-items-list', args=[self.cart.id]))
+
+    def test_cart_item_detail(self):
+        item = CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+        self.assertConstantQueries(1, 'get', reverse('cart-items-detail', args=[self.cart.id, item.id]))
+
+    def test_cart_items_bulk(self):
+        products = [self.create_product(f'Bulk {n}') for n in range(10)]
+        for lines in (1, 10):
+            cart = Cart.objects.create()
+            items = [{'product_id': product.id, 'quantity': 2} for product in products[:lines]]
+            with self.subTest(lines=lines), self.assertNumQueries(8):
+                response = self.client.post(reverse('cart-items-bulk', args=[cart.id]), {'items': items}, format='json')
+            self.assertEqual(response.status_code, 200, response.data)
+
+    def test_checkout(self):
+        products = [self.create_product(f'Checkout {n}') for n in range(10)]
+        for lines in (1, 10):
+            cart = Cart.objects.create()
+            CartItem.objects.bulk_create([CartItem(cart=cart, product=product, quantity=1) for product in products[:lines]])
+            with self.subTest(lines=lines), self.assertNumQueries(14):
+                response = self.client.post(reverse('order-checkout'), {'cart_id': str(cart.id)}, format='json')
+            self.assertEqual(response.status_code, 201, response.data)
+
+    def test_order_list(self):
+        self.assertConstantQueries(1, 'get', reverse('order-list'))
+
+    def test_order_detail(self):
+        self.assertConstantQueries(1, 'get', reverse('order-detail', args=[self.order.id]))
+
+    def test_customer_list(self):
+        self.assertConstantQueries(1, 'get', reverse('customer-list'))
+
+    def test_customer_detail(self):
+        self.assertConstantQueries(1, 'get', reverse('customer-detail', args=[self.customer.id]))
+
+    def test_customer_history(self):
+        url = reverse('customer-history', args=[self.customer.id])
+        self.assertConstantQueries(1, 'get', url)
+        self.assertEqual(self.client.get(url).data['order_count'], 1)
+
+    def test_customer_me(self):
+        self.assertConstantQueries(1, 'get', reverse('customer-me'))
+
+    def test_async_product_list(self):
+        self.assertConstantQueries(2, 'get', reverse('async-product-list'))
+
+    def test_async_product_detail(self):
+        self.assertConstantQueries(1, 'get', reverse('async-product-detail', args=[self.product.id]))
+
+    def test_async_collection_list(self):
+        self.assertConstantQueries(1, 'get', reverse('async-collection-list'))
+
+    def test_async_cart_detail(self):
+        self.assertConstantQueries(2, 'get', reverse('async-cart-detail', args=[self.cart.id]))
+
+
+class SearchTests(APITransactionTestCase):
+    """
+    Runs against the database's own full-text engine, which (for InnoDB)
+    only indexes committed rows, hence the transaction test case.
+    """
+    def setUp(self):
+        response_cache.clear()
+        collection = Collection.objects.create(title='Collection')
+        self.red_shoe = self.create_product('Red shoe', 'Red laces, red sole and a red heel.', collection)
+        self.red_hat = self.create_product('Red hat', 'Wide brim.', collection)
+        self.blue_shoe = self.create_product('Blue shoe', 'Plain.', collection)
+
+    def create_product(self, title, description, collection):
+        return Product.objects.create(
+            title=title, slug=title.lower().replace(' ', '-'), description=description,
+            unit_price=10, inventory=10, collection=collection)
+
+    def search(self, terms):
+        response = self.client.get(reverse('product-list'), {'search': terms})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [product['title'] for product in response.data['results']]
+
+    def test_results_are_ranked_by_relevance(self):
+        self.assertEqual(self.search('red'), ['Red shoe', 'Red hat'])
+        # Every term must match, as a prefix.
+        self.assertEqual(self.search('red sho'), ['Red shoe'])
+        self.assertEqual(sorted(self.search('shoe')), ['Blue shoe', 'Red shoe'])
+        self.assertEqual(self.search('green'), [])
+
+    def test_index_follows_product_changes(self):
+        self.assertEqual(self.search('hat'), ['Red hat'])
+        self.red_hat.title = 'Red cap'
+        self.red_hat.save()
+        self.assertEqual(self.search('hat'), [])
+        self.assertEqual(self.search('cap'), ['Red cap'])
+
+        self.blue_shoe.delete()
+        self.assertEqual(self.search('shoe'), ['Red shoe'])
+        self.create_product('Green shoe', 'Plain.', self.red_shoe.collection)
+        self.assertEqual(sorted(self.search('shoe')), ['Green shoe', 'Red shoe'])
+
+
+@override_settings(STORE_SEARCH_BACKEND='store.search.InMemorySearchBackend')
+class InMemorySearchTests(SearchTests):
+    def setUp(self):
+        get_search_backend().clear()
+        super().setUp()
+
+
+class ProductCountTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Collection.objects.create(title='Shoes')
+        cls.hats = Collection.objects.create(title='Hats')
+        cls.product = cls.create_product('Boot', cls.shoes)
+        cls.create_product('Sandal', cls.shoes)
+
+    @classmethod
+    def create_product(cls, title, collection):
+        return Product.objects.create(title=title, slug=title.lower(), unit_price=10, inventory=1, collection=collection)
+
+    def counts(self):
+        return dict(Collection.objects.filter(pk__in=[self.shoes.pk, self.hats.pk])
+                    .values_list('title', 'product_count'))
+
+    def test_saving_moves_the_product_between_counters(self):
+        self.assertEqual(self.counts(), {'Shoes': 2, 'Hats': 0})
+        product = Product.objects.get(pk=self.product.pk)
+        product.collection = self.hats
+        product.save()
+        self.assertEqual(self.counts(), {'Shoes': 1, 'Hats': 1})
+        # Saving again without a move changes nothing.
+        product.title = 'Bowler'
+        product.save()
+        self.assertEqual(self.counts(), {'Shoes': 1, 'Hats': 1})
+
+    def test_instance_not_loaded_from_the_database(self):
+        product = Product(pk=self.product.pk, title='Boot', slug='boot', unit_price=10, inventory=1,
+                          collection=self.hats)
+        product.save()
+        self.assertEqual(self.counts(), {'Shoes': 1, 'Hats': 1})
+
+    def test_deleting_a_product(self):
+        self.product.delete()
+        self.assertEqual(self.counts(), {'Shoes': 1, 'Hats': 0})
+
+    def test_rebuild_fixes_drifted_counters(self):
+        Collection.objects.update(product_count=7)
+        call_command('rebuild_product_counts', stdout=StringIO())
+        self.assertEqual(self.counts(), {'Shoes': 2, 'Hats': 0})
+
+    def test_counters_are_served_and_guard_deletion(self):
+        response = self.client.get(reverse('collection-detail', args=[self.shoes.id]))
+        self.assertEqual(response.data['product_count'], 2)
+        self.client.force_authenticate(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        response = self.client.delete(reverse('collection-detail', args=[self.shoes.id]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.delete(reverse('collection-detail', args=[self.hats.id])).status_code, 204)
+
+
+class InventoryTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        cls.product = Product.objects.create(
+            title='Product', slug='product', unit_price=10, inventory=20, collection=collection)
+        inventory.rebalance(cls.product.id, shards=4)
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def shard_total(self):
+        return sum(InventoryShard.objects.filter(product=self.product).values_list('quantity', flat=True))
+
+    def test_reserve_takes_from_the_shards(self):
+        inventory.reserve(self.product.id, 3)
+        self.assertEqual(self.shard_total(), 17)
+        # Larger than any one shard: spread over several.
+        token = inventory.reserve(self.product.id, 12)
+        self.assertEqual(self.shard_total(), 5)
+        self.assertEqual(sum(InventoryReservation.objects.filter(token=token).values_list('quantity', flat=True)), 12)
+        self.assertGreater(InventoryReservation.objects.filter(token=token).count(), 1)
+
+    def test_reserve_more_than_available(self):
+        with self.assertRaises(inventory.InsufficientInventory):
+            inventory.reserve(self.product.id, 21)
+        self.assertEqual(self.shard_total(), 20)
+        self.assertFalse(InventoryReservation.objects.exists())
+
+    def test_settle_moves_confirmed_reservations_into_inventory(self):
+        confirmed = inventory.reserve(self.product.id, 5)
+        self.assertTrue(inventory.confirm(confirmed))
+        inventory.reserve(self.product.id, 2)
+
+        self.assertEqual(inventory.settle(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.inventory, 15)
+        # The pending reservation is left alone.
+        self.assertEqual(list(InventoryReservation.objects.values_list('quantity', 'confirmed')), [(2, False)])
+        self.assertEqual(inventory.settle(), 0)
+
+    def test_release_expired_puts_stock_back(self):
+        expired = inventory.reserve(self.product.id, 4, timeout=-1)
+        inventory.reserve(self.product.id, 1)
+        confirmed = inventory.reserve(self.product.id, 2, timeout=-1, confirmed=True)
+
+        self.assertEqual(inventory.release_expired(), 1)
+        self.assertEqual(self.shard_total(), 17)
+        self.assertFalse(InventoryReservation.objects.filter(token=expired).exists())
+        self.assertFalse(inventory.confirm(expired))
+        # Confirmed stock is sold even past its expiry.
+        self.assertTrue(InventoryReservation.objects.filter(token=confirmed).exists())
+
+    def test_edit_keeps_outstanding_reservations(self):
+        inventory.reserve(self.product.id, 6)
+        url = reverse('product-detail', args=[self.product.id])
+        data = self.client.get(url).data
+        self.assertEqual((data['inventory'], data['available_inventory']), (20, 14))
+
+        self.client.force_authenticate(self.admin)
+        data['title'] = 'Renamed'
+        response = self.client.put(url, data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['inventory'], response.data['available_inventory']), (20, 14))
+        self.assertEqual(self.shard_total(), 14)
+
+        # A restock adds to the stock that can be sold.
+        response = self.client.patch(url, {'inventory': 30}, format='json')
+        self.assertEqual(response.data['available_inventory'], 24)
+
+
+class CatalogCacheTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = Collection.objects.create(title='Collection')
+        cls.product = Product.objects.create(
+            title='Product', slug='product', unit_price=5, inventory=10, collection=cls.collection)
+
+    def setUp(self):
+        response_cache.clear()
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response
+
+    def test_changes_are_served_once_committed(self):
+        url = reverse('product-detail', args=[self.product.id])
+        self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.get(url)['X-Cache'], 'HIT')
+
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.product.unit_price = 9
+                self.product.save()
+                # Requests running meanwhile still read the old rows, so
+                # they must keep caching them under the old version.
+                self.assertEqual(get_catalog_version(), version)
+        self.assertGreater(get_catalog_version(), version)
+
+        response = self.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['unit_price'], 9)
+
+    def test_list_follows_collection_and_tag_changes(self):
+        url = reverse('product-list') + '?include=tags'
+        self.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            TaggedItem.objects.create(tag=Tag.objects.create(label='New'), content_object=self.product)
+        response = self.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['tags'], ['New'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.collection.title = 'Renamed'
+            self.collection.save()
+        self.assertEqual(self.get(reverse('collection-list'))['X-Cache'], 'MISS')
+
+
+class ProductListSerializerTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('user', 'user@example.com', 'password')
+        collection = Collection.objects.create(title='Collection')
+        products = [
+            Product.objects.create(title=f'Product {n}', slug=f'product-{n}', description=description,
+                                   unit_price=price, inventory=10, collection=collection)
+            for n, (price, description) in enumerate([('0.10', ''), ('19.99', 'Déjà vu'), ('5', 'Plain')])]
+        inventory.rebalance(products[1].id, shards=2)
+        inventory.reserve(products[1].id, 3)
+        TaggedItem.objects.create(tag=Tag.objects.create(label='Tag'), content_object=products[0])
+        LikedItem.objects.create(user=cls.user, content_object=products[2])
+
+    def test_renders_the_same_bytes_as_product_serializer(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        queryset = ProductViewSet.queryset.order_by('id')
+        rows = queryset.values(*ProductListSerializer.value_fields)
+        for context in ({}, {'request': request, 'include_tags': True, 'include_likes': True}):
+            with self.subTest(context=context):
+                self.assertEqual(
+                    JSONRenderer().render(ProductListSerializer(rows, context).data),
+                    JSONRenderer().render(ProductSerializer(queryset, many=True, context=context).data))
+
+    def test_list_goes_through_the_response_cache(self):
+        response_cache.clear()
+        url = reverse('product-list')
+        first, second = self.client.get(url), self.client.get(url)
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(first.content, second.content)
+        self.assertIn('ETag', second)
+
+
+class AsyncViewTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('user', 'user@example.com', 'password')
+        collection = Collection.objects.create(title='Collection')
+        cls.products = [
+            Product.objects.create(title=f'Product {n}', slug=f'product-{n}', unit_price=10, inventory=10,
+                                   collection=collection)
+            for n in range(3)]
+        TaggedItem.objects.create(tag=Tag.objects.create(label='Tag'), content_object=cls.products[0])
+        LikedItem.objects.create(user=cls.user, content_object=cls.products[1])
+
+    def setUp(self):
+        response_cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def test_product_responses_match_the_sync_endpoints(self):
+        for include in ('', 'tags', 'likes', 'tags,likes'):
+            for name, args in (('product-list', []), ('product-detail', [self.products[1].id])):
+                with self.subTest(include=include, route=name):
+                    sync = self.client.get(reverse(name, args=args), {'include': include})
+                    response = self.client.get(reverse(f'async-{name}', args=args), {'include': include})
+                    self.assertEqual(response.status_code, 200)
+                    expected, data = json.loads(sync.content), json.loads(response.content)
+                    if name == 'product-list':
+                        expected, data = expected['results'], data['results']
+                    self.assertEqual(data, expected)
+
+    def test_likes_are_not_cached(self):
+        url = reverse('async-product-list') + '?include=likes'
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertNotIn('X-Cache', response)
+        self.assertTrue(json.loads(response.content)['results'][1]['liked'])
+
+
+class UserCacheTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('user', 'user@example.com', 'password')
+
+    def setUp(self):
+        user_cache.clear()
+        self.client.cookies[settings.JWT_COOKIE_NAME] = str(AccessToken.for_user(self.user))
+
+    def me(self):
+        return self.client.get(reverse('customer-me'))
+
+    def test_deactivated_user_is_rejected(self):
+        hits = user_cache.stats()['hits']
+        self.assertEqual(self.me().status_code, 200)
+        self.assertEqual(self.me().status_code, 200)
+        self.assertEqual(user_cache.stats()['hits'], hits + 1)
+
+        version = get_user_version(str(self.user.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.user.is_active = False
+                self.user.save()
+                # Other workers still read the active row until the commit.
+                self.assertEqual(get_user_version(str(self.user.pk)), version)
+        self.assertEqual(self.me().status_code, 401)
+
+
+class PermissionCacheTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('user', 'user@example.com', 'password')
+        cls.customer = Customer.objects.create(user=cls.user, phone='555-0100')
+        cls.group = Group.objects.create(name='Support')
+        cls.group.permissions.add(Permission.objects.get(codename='view_history'))
+
+    def setUp(self):
+        permission_cache.clear()
+        self.client.cookies[settings.JWT_COOKIE_NAME] = str(AccessToken.for_user(self.user))
+
+    def history(self):
+        return self.client.get(reverse('customer-history', args=[self.customer.id])).status_code
+
+    def test_granted_and_revoked_permissions_apply_to_the_next_request(self):
+        self.assertEqual(self.history(), 403)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group)
+        self.assertEqual(self.history(), 200)
+        self.assertEqual(self.history(), 200)
+
+        version = get_permission_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.group.permissions.clear()
+                self.assertEqual(get_permission_version(), version)
+        self.assertEqual(self.history(), 403)
+
+
+class CartItemViewSetTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        cls.products = [
+            Product.objects.create(title=f'Product {n}', slug=f'product-{n}', unit_price=price, inventory=10,
+                                   collection=collection)
+            for n, price in enumerate(['2.50', '4.00'])]
+        cls.cart = Cart.objects.create()
+        for product, quantity in zip(cls.products, (2, 3)):
+            CartItem.objects.create(cart=cls.cart, product=product, quantity=quantity)
+
+    def test_total_price_is_readable_cross_origin(self):
+        response = self.client.get(reverse('cart-items-list', args=[self.cart.id]),
+                                   HTTP_ORIGIN=settings.CORS_ALLOWED_ORIGINS[0])
+        self.assertEqual(Decimal(response['X-Cart-Total-Price']), Decimal('17.00'))
+        self.assertIn('X-Cart-Total-Price', response['Access-Control-Expose-Headers'])
+
+    def test_bulk_sets_quantities(self):
+        response = self.client.post(reverse('cart-items-bulk', args=[self.cart.id]), {'items': [
+            {'product_id': self.products[0].id, 'quantity': 0},
+            {'product_id': self.products[1].id, 'quantity': 7},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(list(self.cart.items.values_list('product_id', 'quantity')), [(self.products[1].id, 7)])
+
+    def test_bulk_with_a_line_added_concurrently(self):
+        cart = Cart.objects.create()
+        bulk_create = CartItem.objects.bulk_create
+
+        def add_then_bulk_create(objs, **kwargs):
+            # A single add from another request lands between the lookup
+            # of the existing lines and their creation.
+            CartItem.objects.add(cart.id, self.products[0].id, 5)
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(CartItem.objects, 'bulk_create', add_then_bulk_create):
+            response = self.client.post(reverse('cart-items-bulk', args=[cart.id]), {'items': [
+                {'product_id': self.products[0].id, 'quantity': 2},
+            ]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(cart.items.get().quantity, 2)
+
+    def test_bulk_with_a_malformed_cart_id(self):
+        response = self.client.post(reverse('cart-items-bulk', args=['not-a-uuid']), {'items': [
+            {'product_id': self.products[0].id, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+class CartItemAddTests(TransactionTestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.product = Product.objects.create(
+            title='Product', slug='product', unit_price=10, inventory=20, collection=collection)
+        self.cart = Cart.objects.create()
+
+    def test_add_inserts_then_increments(self):
+        first = CartItem.objects.add(self.cart.id, self.product.id, 2)
+        second = CartItem.objects.add(self.cart.id, self.product.id, 3)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(second.quantity, 5)
+        self.assertEqual(CartItem.objects.get().quantity, 5)
+
+    def test_add_after_a_concurrent_insert(self):
+        # The line another request inserted since this one last looked.
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+        item = CartItem.objects.add(self.cart.id, self.product.id, 2)
+        self.assertEqual(item.quantity, 3)
+        self.assertEqual(CartItem.objects.count(), 1)
+
+    def test_add_missing_product(self):
+        with self.assertRaises(IntegrityError):
+            CartItem.objects.add(self.cart.id, self.product.id + 1, 1)
+
+    @skipIf(connection.vendor == 'sqlite', 'SQLite runs one writer at a time.')
+    def test_concurrent_adds(self):
+        threads, adds = 8, 5
+        barrier = Barrier(threads)
+
+        def add():
+            barrier.wait()
+            try:
+                for _ in range(adds):
+                    CartItem.objects.add(self.cart.id, self.product.id, 1)
+            finally:
+                connection.close()
+
+        workers = [Thread(target=add) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(CartItem.objects.get().quantity, threads * adds)
+
+
+class KeysetPaginationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        Product.objects.bulk_create([
+            Product(title='Tied' if n % 5 else f'Product {n:02}', slug=f'product-{n}', unit_price=10 + n % 3,
+                    inventory=10, collection=collection)
+            for n in range(25)])
+        cls.product_ids = list(Product.objects.order_by('title', 'id').values_list('id', flat=True))
+
+    def setUp(self):
+        response_cache.clear()
+
+    def walk(self, url, link):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.data)
+            page = [product['id'] for product in response.data['results']]
+            ids = ids + page if link == 'next' else page + ids
+            url = response.data[link]
+        return ids
+
+    def test_pages_with_tied_titles(self):
+        self.assertEqual(self.walk(reverse('product-list') + '?pagination=cursor', 'next'), self.product_ids)
+
+    def test_pages_back_with_tied_titles(self):
+        url = reverse('product-list') + '?pagination=cursor'
+        while True:
+            response = self.client.get(url)
+            if not response.data['next']:
+                break
+            url = response.data['next']
+        last_page = [product['id'] for product in response.data['results']]
+        self.assertEqual(self.walk(response.data['previous'], 'previous') + last_page, self.product_ids)
+
+    def test_descending_ordering_with_ties(self):
+        url = reverse('product-list') + '?pagination=cursor&ordering=-unit_price'
+        expected = list(Product.objects.order_by('-unit_price', 'title', 'id').values_list('id', flat=True))
+        self.assertEqual(self.walk(url, 'next'), expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('product-list') + '?pagination=cursor&cursor=bogus')
+        self.assertEqual(response.status_code, 404)
+
+
+class TokenRefreshTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('user', 'user@example.com', 'password')
+
+    def refresh(self, token):
+        self.client.cookies[settings.JWT_REFRESH_COOKIE_NAME] = str(token)
+        return self.client.post(reverse('refresh'))
+
+    def test_refresh(self):
+        response = self.refresh(RefreshToken.for_user(self.user))
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertIn(settings.JWT_COOKIE_NAME, response.cookies)
+
+    def test_revoked_token_is_rejected(self):
+        token = RefreshToken.for_user(self.user)
+        revocation_store.revoke(token)
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+    def test_revocation_reaches_other_processes_before_their_sync(self):
+        other_process = RevocationStore(capacity=1000, sync_interval=3600)
+        token = RefreshToken.for_user(self.user)
+        self.assertFalse(other_process.is_revoked(token['jti']))
+        with self.captureOnCommitCallbacks(execute=True):
+            revocation_store.revoke(token)
+        self.assertTrue(other_process.is_revoked(token['jti']))
+
+    def test_rotated_token_is_rejected(self):
+        token = RefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token).status_code, 200)
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+
+class ImportCatalogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = Collection.objects.create(title='Collection')
+
+    def import_feed(self, name, content, *args):
+        stdout, stderr = StringIO(), StringIO()
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / name
+            path.write_text(content, encoding='utf-8')
+            call_command('import_catalog', 'products', str(path), *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_bad_ndjson_rows_are_rejected(self):
+        rows = [
+            {'title': 'Good', 'unit_price': '5.00', 'inventory': 3, 'collection': 'Collection'},
+            'not json',
+            [1, 2],
+            {'title': 'Bad price', 'unit_price': 'free', 'inventory': 3, 'collection': 'Collection'},
+            {'title': 'No collection', 'unit_price': '5.00', 'inventory': 3, 'collection': 'Missing'},
+        ]
+        feed = '\n'.join(row if isinstance(row, str) else json.dumps(row) for row in rows)
+        stdout, stderr = self.import_feed('products.ndjson', feed, '--batch-size', '2')
+
+        self.assertEqual(list(Product.objects.values_list('title', flat=True)), ['Good'])
+        self.assertIn('Imported 1 of 5 products rows', stdout)
+        self.assertIn('4 rejected', stdout)
+        for line in (2, 3, 4, 5):
+            self.assertIn(f'row {line}:', stderr)
+
+    def test_unknown_collection_ids_are_rejected(self):
+        feed = ('title,unit_price,inventory,collection_id\n'
+                f'Good,5.00,3,{self.collection.id}\n'
+                f'Unknown,5.00,3,{self.collection.id + 1}\n'
+                'Malformed,5.00,3,first\n')
+        stdout, stderr = self.import_feed('products.csv', feed)
+        self.assertEqual(list(Product.objects.values_list('title', flat=True)), ['Good'])
+        self.assertIn('2 rejected', stdout)
+        self.assertIn('row 2: unknown collection id', stderr)
+        self.collection.refresh_from_db()
+        self.assertEqual(self.collection.product_count, 1)
+
+    def test_bad_csv_rows_are_rejected(self):
+        feed = ('title,unit_price,inventory,collection\n'
+                'Good,5.00,3,Collection\n'
+                'Bad inventory,5.00,-1,Collection\n')
+        stdout, stderr = self.import_feed('products.csv', feed)
+        self.assertEqual(list(Product.objects.values_list('title', flat=True)), ['Good'])
+        self.assertIn('1 rejected', stdout)
+
+    def test_only_the_first_errors_are_reported(self):
+        feed = '\n'.join('not json' for _ in range(REPORTED_ERRORS + 5))
+        stdout, stderr = self.import_feed('products.ndjson', feed)
+        self.assertIn(f'{REPORTED_ERRORS + 5} rejected', stdout)
+        self.assertEqual(len(stderr.splitlines()), REPORTED_ERRORS)
+
+
+class ConditionalGetTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = Collection.objects.create(title='Collection')
+        cls.product = Product.objects.create(
+            title='Product', slug='product', unit_price=10, inventory=10, collection=cls.collection)
+        cls.cart = Cart.objects.create()
+
+    def setUp(self):
+        response_cache.clear()
+
+    def get(self, url, status=200, **headers):
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, status)
+        if status == 304:
+            self.assertEqual(response.content, b'')
+        return response
+
+    def change_product(self, **fields):
+        # Moves last_update past the second the first response was served in.
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.get(pk=self.product.pk)
+            for field, value in fields.items():
+                setattr(product, field, value)
+            product.save()
+        Product.objects.filter(pk=product.pk).update(last_update=product.last_update + timedelta(seconds=5))
+
+    def test_product_detail(self):
+        url = reverse('product-detail', args=[self.product.id])
+        response = self.get(url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.get(url, 304, if_none_match=etag)['ETag'], etag)
+        self.get(url, 304, if_modified_since=last_modified)
+        # The ETag covers the format the body is rendered in.
+        self.get(url + '?format=api', 200, if_none_match=etag)
+
+        self.change_product(unit_price=12)
+        response = self.get(url, 200, if_none_match=etag)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['unit_price'], 12)
+        self.get(url, 200, if_modified_since=last_modified)
+
+    def test_sharded_product_detail_has_no_last_modified(self):
+        inventory.rebalance(self.product.id, shards=2)
+        url = reverse('product-detail', args=[self.product.id])
+        response = self.get(url)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.get(url, 304, if_none_match=etag)
+        # Reservations don't touch last_update but change the stock served.
+        inventory.reserve(self.product.id, 1)
+        self.assertNotEqual(self.get(url, 200, if_none_match=etag)['ETag'], etag)
+
+    def test_missing_product_detail(self):
+        self.get(reverse('product-detail', args=[0]), 404, if_none_match='*')
+        self.get(reverse('product-detail', args=['x']), 404)
+
+    def test_product_list(self):
+        url = reverse('product-list')
+        etag = self.get(url)['ETag']
+        self.get(url, 304, if_none_match=etag)
+        self.change_product(title='Renamed')
+        self.assertNotEqual(self.get(url, 200, if_none_match=etag)['ETag'], etag)
+
+    def test_cart_detail(self):
+        url = reverse('cart-detail', args=[self.cart.id])
+        etag = self.get(url)['ETag']
+        self.get(url, 304, if_none_match=etag)
+
+        item = CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+        response = self.get(url, 200, if_none_match=etag)
+        self.assertEqual(len(response.data['items']), 1)
+        etag = response['ETag']
+        # A line removed and added back with the same quantity is still a change.
+        item.delete()
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+        self.assertNotEqual(self.get(url, 200, if_none_match=etag)['ETag'], etag)
+
+    def test_missing_cart(self):
+        self.get(reverse('cart-detail', args=[uuid4()]), 404)
+        self.get(reverse('cart-detail', args=['not-a-uuid']), 404)
+
+
+@mock.patch.object(routers, 'REPLICAS', ['replica'])
+@mock.patch.object(routers, 'available_replica', lambda: 'replica')
+class ReplicaRoutingTests(SimpleTestCase):
+    def request(self, method, reads=(), writes=(), cookies=None):
+        """
+        Sends a request through ReplicaRoutingMiddleware whose view makes the
+        given writes and then reads, and returns the response and the alias
+        each read was routed to.
+        """
+        request = getattr(RequestFactory(), method)(reverse('product-list'))
+        request.resolver_match = resolve(reverse('product-list'))
+        request.COOKIES.update(cookies or {})
+        router = routers.ReplicaRouter()
+        aliases = []
+
+        def view(request):
+            for model in writes:
+                router.db_for_write(model)
+            aliases.extend(router.db_for_read(model) for model in reads)
+            return HttpResponse()
+
+        return routers.ReplicaRoutingMiddleware(view)(request), aliases
+
+    def test_reads_go_to_the_replica(self):
+        response, aliases = self.request('get', reads=[Product])
+        self.assertEqual(aliases, ['replica'])
+        self.assertNotIn(routers.STICKY_COOKIE_NAME, response.cookies)
+
+    def test_reads_after_a_write_stay_on_the_primary(self):
+        response, aliases = self.request('get', reads=[Product], writes=[Product])
+        self.assertEqual(aliases, [None])
+        self.assertIn(routers.STICKY_COOKIE_NAME, response.cookies)
+
+    def test_client_sticks_to_the_primary_after_a_write(self):
+        response, aliases = self.request('post', writes=[Product])
+        cookie = response.cookies[routers.STICKY_COOKIE_NAME]
+        self.assertEqual(cookie['max-age'], routers.STICKY_SECONDS)
+
+        response, aliases = self.request('get', reads=[Product], cookies={cookie.key: cookie.value})
+        self.assertEqual(aliases, [None])
+
+        expired = str(time.time() - 1)
+        response, aliases = self.request('get', reads=[Product], cookies={cookie.key: expired})
+        self.assertEqual(aliases, ['replica'])
+
+    def test_reads_after_read_from_primary_stay_on_the_primary(self):
+        router = routers.ReplicaRouter()
+        aliases = []
+
+        def view(request):
+            aliases.append(router.db_for_read(Product))
+            routers.read_from_primary()
+            aliases.append(router.db_for_read(Product))
+            return HttpResponse()
+
+        request = RequestFactory().get(reverse('product-list'))
+        request.resolver_match = resolve(reverse('product-list'))
+        response = routers.ReplicaRoutingMiddleware(view)(request)
+        self.assertEqual(aliases, ['replica', None])
+        # Only writes make the client sticky.
+        self.assertNotIn(routers.STICKY_COOKIE_NAME, response.cookies)
+
+
+# Replica reads are routed to the test database itself, so they return
+# 'default' while reads kept on the primary return None.
+@mock.patch.object(routers, 'REPLICAS', ['replica'])
+@mock.patch.object(routers, 'available_replica', lambda: DEFAULT_DB_ALIAS)
+class ReplicaCacheTests(APITransactionTestCase):
+    # Reads inside a transaction stay on the primary, so no TestCase.
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.product = Product.objects.create(
+            title='Product', slug='product', unit_price=10, inventory=10, collection=collection)
+        response_cache.clear()
+        self.aliases = []
+        db_for_read = routers.ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            alias = db_for_read(router, model, **hints)
+            self.aliases.append(alias)
+            return alias
+
+        patcher = mock.patch.object(routers.ReplicaRouter, 'db_for_read', record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_uncached_routes_read_from_the_replica(self):
+        self.client.get(reverse('product-reviews-list', args=[self.product.id]))
+        self.assertEqual(set(self.aliases), {DEFAULT_DB_ALIAS})
+
+    def test_cached_responses_are_read_from_the_primary(self):
+        for url in (reverse('product-list'), reverse('product-detail', args=[self.product.id]),
+                    reverse('async-product-list')):
+            with self.subTest(url=url):
+                self.aliases.clear()
+                first = self.client.get(url)
+                self.assertEqual(first['X-Cache'], 'MISS')
+                self.assertEqual(set(self.aliases), {None})
+                second = self.client.get(url)
+                self.assertEqual(second['X-Cache'], 'HIT')
+
+    def test_validators_are_read_from_the_primary(self):
+        url = reverse('product-detail', args=[self.product.id])
+        etag = self.client.get(url)['ETag']
+        self.aliases.clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(set(self.aliases), {None})
+
+
+class CustomerOrderStatsTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create(username='buyer', email='buyer@example.com')
+        cls.customer = Customer.objects.create(user=cls.user, phone='555-0100')
+        cls.other = Customer.objects.create(
+            user=User.objects.create(username='other', email='other@example.com'), phone='555-0101')
+        collection = Collection.objects.create(title='Collection')
+        cls.product = Product.objects.create(
+            title='Product', slug='product', unit_price=5, inventory=100, collection=collection)
+
+    def stats(self, customer=None):
+        row = CustomerOrderStats.objects.filter(customer=customer or self.customer) \
+            .values_list('order_count', 'lifetime_spend').first()
+        return row and (row[0], Decimal(row[1]))
+
+    def test_orders_and_lines(self):
+        order = Order.objects.create(customer=self.customer)
+        self.assertEqual(self.stats(), (1, 0))
+        self.assertEqual(CustomerOrderStats.objects.get(customer=self.customer).last_order_at, order.placed_at)
+
+        OrderItem.objects.create(order=order, product=self.product, quantity=2, unit_price=5)
+        self.assertEqual(self.stats(), (1, 10))
+        item = OrderItem.objects.get(order=order)
+        item.quantity = 3
+        item.save()
+        self.assertEqual(self.stats(), (1, 15))
+        # An unchanged line is saved without touching the stats.
+        with self.assertNumQueries(1):
+            item.save()
+
+        item.delete()
+        self.assertEqual(self.stats(), (1, 0))
+        order.delete()
+        self.assertEqual(self.stats(), (0, 0))
+
+    def test_moves_between_customers(self):
+        order = Order.objects.create(customer=self.customer)
+        other_order = Order.objects.create(customer=self.other)
+        item = OrderItem.objects.create(order=order, product=self.product, quantity=2, unit_price=5)
+
+        item.order = other_order
+        item.save()
+        self.assertEqual((self.stats(), self.stats(self.other)), ((1, 0), (1, 10)))
+
+        order = Order.objects.get(pk=order.pk)
+        order.customer = self.other
+        order.save()
+        self.assertEqual((self.stats(), self.stats(self.other)), ((0, 0), (2, 10)))
+
+        order.delete()
+        self.assertEqual(self.stats(self.other), (1, 10))
+
+    def test_checkout_counts_the_order_once(self):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=4)
+        self.client.force_authenticate(self.user)
+        response = self.client.post(reverse('order-checkout'), {'cart_id': cart.id}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.stats(), (1, 20))
+
+    def test_rebuild_fixes_drifted_stats(self):
+        order = Order.objects.create(customer=self.customer)
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, unit_price=5)
+        CustomerOrderStats.objects.filter(customer=self.customer).update(order_count=9, lifetime_spend=0)
+        call_command('rebuild_customer_stats', stdout=StringIO())
+        self.assertEqual(self.stats(), (1, 5))
+        self.assertEqual(self.stats(self.other), (0, 0))
@@ -1,6 +1,6 @@
 from django.urls import path
 from rest_framework_nested import routers
-from . import views
+from . import async_views, views
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
 #URLConfig
@@ -16,4 +16,9 @@ product_router.register('reviews', views.ReviewViewSet, basename='product-review
 
 cart_router = routers.NestedDefaultRouter(router, 'carts', lookup='cart')
 cart_router.register('items', views.CartItemViewSet, basename='cart-items')
-urlpatterns = router.urls + product_router.urls + cart_router.urls
\ No newline at end of file
+urlpatterns = router.urls + product_router.urls + cart_router.urls + [
+    path('async/products/', async_views.product_list, name='async-product-list'),
+    path('async/products/<str:pk>/', async_views.product_detail, name='async-product-detail'),
+    path('async/collections/', async_views.collection_list, name='async-collection-list'),
+    path('async/carts/<str:pk>/', async_views.cart_detail, name='async-cart-detail'),
+]
\ No newline at end of file
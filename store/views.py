@@ -1,47 +1,146 @@
 from django.shortcuts import get_object_or_404
-from django.db.models.aggregates import Count
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Exists, OuterRef, Prefetch
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.conf import settings
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, DjangoModelPermissions, DjangoModelPermissionsOrAnonReadOnly, AllowAny
-from .models import Product, Collection, OrderItem, Review, Cart, CartItem, Order, Customer
+from likes.buffer import like_buffer
+from .models import Product, Collection, OrderItem, Review, Cart, CartItem, Order, Customer, CustomerOrderStats, InventoryShard
+from .cache import CatalogCacheMixin, ConditionalGetMixin, get_catalog_modified, get_catalog_version
+from .export import CHUNK_SIZE as EXPORT_CHUNK_SIZE, EXPORT_FORMATS, keyset_rows
 from .filters import ProductFilter
+from .inventory import available_inventory
 from .permissions import IsAdminOrReadOnly, FullDjangoModelPermissions, CanViewCsutomerHistoryPermission
-from .pagination import DefaultPagination
-from .serializers import ProductSerializer, CollectionSerializer, ReviewSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, OrderItemSerializer, OrderSerializer, CustomerSerializer
+from .pagination import DefaultPagination, KeysetPagination
+from .revocation import revocation_store
+from .search import FullTextSearchFilter
+from .serializers import ProductSerializer, ProductListSerializer, CollectionSerializer, ReviewSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer, BulkCartItemSerializer, UpdateCartItemSerializer, OrderItemSerializer, OrderSerializer, CheckoutSerializer, CustomerSerializer, CustomerOrderStatsSerializer, RevocableTokenRefreshSerializer
 
 
 # Create your views here.
-class CollectionViewSet(ModelViewSet):
-    queryset = Collection.objects.annotate(product_count=Count('products')).all().order_by('title')
+class ValuesListModelMixin:
+    """
+    Read-only fast path for list: serializes values() rows with
+    `list_serializer_class` instead of building model instances. List it
+    after CatalogCacheMixin and ConditionalGetMixin in the bases, so its
+    list() runs inside theirs and responses are still cached and validated.
+    """
+    list_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.values(*self.list_serializer_class.value_fields)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.list_serializer_class(page, self.get_serializer_context()).data)
+        return Response(self.list_serializer_class(queryset, self.get_serializer_context()).data)
+
+class CollectionViewSet(CatalogCacheMixin, ModelViewSet):
+    queryset = Collection.objects.all().order_by('title')
     serializer_class = CollectionSerializer
     permission_classes = [IsAdminOrReadOnly]
 
     def destroy(self, request, *args, **kwargs):
-        if Collection.objects.select_related('products').filter(id=kwargs['pk']).count() > 0:
+        if self.get_object().product_count > 0:
             return Response({'error': 'Can not delete collection, contains one or more products'}, status=status.HTTP_400_BAD_REQUEST)
         return super().destroy(request, *args, **kwargs)
 
-class ProductViewSet(ModelViewSet):
-    queryset = Product.objects.all()
+class ProductViewSet(ConditionalGetMixin, CatalogCacheMixin, ValuesListModelMixin, ModelViewSet):
+    queryset = Product.objects.annotate(available_inventory=available_inventory())
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    list_serializer_class = ProductListSerializer
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
     pagination_class = DefaultPagination
     search_fields = ['title', 'description']
     ordering_fields = ['unit_price', 'last_update']
     permission_classes = [IsAdminOrReadOnly]
 
+    @property
+    def paginator(self):
+        # Clients opt into keyset pagination with ?pagination=cursor; the
+        # cursor links it returns keep that parameter.
+        if not hasattr(self, '_paginator'):
+            request = getattr(self, 'request', None)
+            if request is not None and request.query_params.get('pagination') == 'cursor':
+                self._paginator = KeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
     def get_serializer_context(self):
-        return {'request': self.request}
+        include = self.request.query_params.get('include', '').split(',')
+        return {'request': self.request, 'include_tags': 'tags' in include, 'include_likes': 'likes' in include}
+
+    def get_cache_key(self, request):
+        # Likes are per user and change too often to cache.
+        if self.get_serializer_context()['include_likes']:
+            return None
+        return super().get_cache_key(request)
+
+    def get_list_validators(self, request, *args, **kwargs):
+        if self.get_serializer_context()['include_likes']:
+            return None
+        # Any catalog change, including stock moved by reservations, bumps
+        # the catalog version, so no query is needed.
+        return (get_catalog_version(), request.get_full_path()), get_catalog_modified()
+
+    def get_retrieve_validators(self, request, *args, **kwargs):
+        if self.get_serializer_context()['include_likes']:
+            return None
+        row = self.get_queryset().filter(pk=kwargs['pk']) \
+            .annotate(sharded=Exists(InventoryShard.objects.filter(product=OuterRef('pk')))) \
+            .values_list('last_update', 'available_inventory', 'sharded').first()
+        if row is None:
+            return None
+        last_update, stock, sharded = row
+        if self.get_serializer_context()['include_tags']:
+            # Tagging doesn't touch last_update either, but bumps the catalog version.
+            return (kwargs['pk'], last_update.isoformat(), stock, get_catalog_version()), None
+        if sharded:
+            # Reservations and settling move sharded stock without touching
+            # last_update, so only the ETag, which includes the stock, is valid.
+            return (kwargs['pk'], last_update.isoformat(), stock), None
+        return (kwargs['pk'], last_update.isoformat(), stock), last_update.timestamp()
+
+
+    @action(detail=False, methods=['GET'])
+    def export(self, request):
+        # Streams every product matching the list filters as NDJSON or CSV,
+        # in id order so it can be read in keyset pages.
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            return Response({'error': f'Unsupported export format: {export_format}'}, status=status.HTTP_400_BAD_REQUEST)
+        content_type, render = EXPORT_FORMATS[export_format]
+
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = keyset_rows(queryset, ProductListSerializer.value_fields, EXPORT_CHUNK_SIZE)
+        serializer = ProductListSerializer(rows)
+        products = map(serializer.to_representation, rows)
+
+        response = StreamingHttpResponse(render(products, ProductSerializer.Meta.fields), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="products.{export_format}"'
+        return response
+
+    @action(detail=True, methods=['POST', 'DELETE'], permission_classes=[IsAuthenticated])
+    def like(self, request, pk):
+        # POST likes, DELETE unlikes. Written behind by likes.buffer, so
+        # ?include=likes catches up within LIKES_BUFFER['FLUSH_INTERVAL'].
+        product = self.get_object()
+        like_buffer.set(request.user.id, ContentType.objects.get_for_model(Product).id, product.id,
+                        request.method == 'POST')
+        return Response(status=status.HTTP_202_ACCEPTED)
     
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=kwargs['pk']).count() > 0:
@@ -58,14 +157,28 @@ class ReviewViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'product_id': self.kwargs['product_pk']}
     
-class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
-    queryset = Cart.objects.prefetch_related('items__product').all()
+class CartViewSet(ConditionalGetMixin, CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
+    queryset = Cart.objects.with_total_price().prefetch_related(
+        Prefetch('items', queryset=CartItem.objects.select_related('product').with_total_price())
+    )
     serializer_class = CartSerializer
 
+    def get_retrieve_validators(self, request, *args, **kwargs):
+        # Carts are small: the lines and their product versions make the ETag.
+        # An empty cart yields one row of NULLs, a missing cart none.
+        lines = list(Cart.objects.filter(pk=kwargs['pk'])
+                     .values_list('items__id', 'items__product_id', 'items__quantity', 'items__product__last_update')
+                     .order_by('items__id'))
+        if not lines:
+            return None
+        return lines, None
+
 
 class CartItemViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
     def get_serializer_class(self):
+        if self.action == 'bulk':
+            return BulkCartItemSerializer
         if self.request.method == 'POST':
             return AddCartItemSerializer
         elif self.request.method == 'PATCH':
@@ -76,12 +189,32 @@ class CartItemViewSet(ModelViewSet):
         return {'cart_id': self.kwargs['cart_pk']}
 
     def get_queryset(self):
-        return CartItem.objects.filter(cart_id=self.kwargs['cart_pk']).select_related('product')
+        return CartItem.objects.filter(cart_id=self.kwargs['cart_pk']).select_related('product').with_total_price()
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        response['X-Cart-Total-Price'] = str(CartItem.objects.filter(cart_id=self.kwargs['cart_pk']).total_price())
+        return response
+
+    @action(detail=False, methods=['POST'])
+    def bulk(self, request, cart_pk):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        cart = CartViewSet.queryset.get(pk=cart_pk)
+        return Response(CartSerializer(cart).data)
     
 class OrderViewset(ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
 
+    @action(detail=False, methods=['POST'], permission_classes=[IsAuthenticated])
+    def checkout(self, request):
+        serializer = CheckoutSerializer(data=request.data, context={'user_id': request.user.id})
+        serializer.is_valid(raise_exception=True)
+        order = serializer.save()
+        return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
+
 
 class OrderItemSerializer(ModelViewSet):
     queryset = OrderItem.objects.all()
@@ -93,9 +226,20 @@ class CustomerViewset(ModelViewSet):
     serializer_class = CustomerSerializer
     permission_classes = [DjangoModelPermissionsOrAnonReadOnly]
 
+    def get_queryset(self):
+        if self.action == 'history':
+            return Customer.objects.select_related('order_stats')
+        return super().get_queryset()
+
     @action(detail=True, permission_classes=[CanViewCsutomerHistoryPermission])
     def history(self, request, pk):
-        return Response('Ok')
+        customer = self.get_object()
+        try:
+            stats = customer.order_stats
+        except CustomerOrderStats.DoesNotExist:
+            # Customers without orders may not have a stats row yet.
+            stats = CustomerOrderStats(customer=customer)
+        return Response(CustomerOrderStatsSerializer(stats).data)
 
     @action(detail=False, methods=['GET', 'PUT'], permission_classes=[IsAuthenticated])
     def me(self, request):
@@ -152,6 +296,8 @@ class CookieTokenRefreshView(TokenRefreshView):
     """
     Token refresh view that handles HTTP-only cookies
     """
+    serializer_class = RevocableTokenRefreshSerializer
+
     def post(self, request, *args, **kwargs):
         # Get refresh token from cookie
         refresh_token = request.COOKIES.get(settings.JWT_REFRESH_COOKIE_NAME)
@@ -168,6 +314,8 @@ class CookieTokenRefreshView(TokenRefreshView):
         
         if response.status_code == 200:
             access_token = response.data['access']
+            # Present when ROTATE_REFRESH_TOKENS is on; the old token is revoked
+            rotated_refresh_token = response.data.get('refresh')
             response.data = {'message': 'Token refreshed'}
             
             # Set new access token cookie
@@ -179,6 +327,16 @@ class CookieTokenRefreshView(TokenRefreshView):
                 secure=settings.JWT_COOKIE_SECURE,
                 samesite=settings.JWT_COOKIE_SAME_SITE,
             )
+
+            if rotated_refresh_token:
+                response.set_cookie(
+                    settings.JWT_REFRESH_COOKIE_NAME,
+                    rotated_refresh_token,
+                    max_age=settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME'].total_seconds(),
+                    httponly=settings.JWT_COOKIE_HTTP_ONLY,
+                    secure=settings.JWT_COOKIE_SECURE,
+                    samesite=settings.JWT_COOKIE_SAME_SITE,
+                )
         
         return response
 
@@ -194,8 +352,8 @@ def logout_view(request):
     if refresh_token:
         try:
             token = RefreshToken(refresh_token)
-            token.blacklist()
-        except Exception:
+            revocation_store.revoke(token)
+        except TokenError:
             pass  # Token might already be invalid
     
     response = Response({'message': 'Logged out successfully'})
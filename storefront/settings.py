@@ -52,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -61,6 +62,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'store.routers.ReplicaRoutingMiddleware',
 ]
 
 INTERNAL_IPS = [
@@ -103,6 +105,31 @@ DATABASES = {
     }
 }
 
+# The catalog and permission versions (store.cache, store.backends), the
+# per-user versions of the authentication cache and recently revoked refresh
+# tokens (store.revocation) live in the default cache, and every worker
+# process must see the same values, otherwise a change made in one worker is
+# not noticed by the others. Production therefore needs a
+# shared backend; LocMemCache is only correct with a single process.
+# `manage.py check --deploy` warns about this (store.W001).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    } if not IS_LOCAL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Safe requests on the store endpoints read from these DATABASES aliases
+# (see store.routers). Leave ALIASES empty to read from 'default' only.
+DATABASE_ROUTERS = ['store.routers.ReplicaRouter']
+STORE_DB_REPLICAS = {
+    'ALIASES': [],
+    'STICKY_SECONDS': 5,
+    'RETRY_AFTER': 30,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -162,11 +189,38 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+STORE_METRICS = {
+    # Addresses allowed to scrape /metrics/.
+    'ALLOWED_IPS': ['127.0.0.1'],
+}
+
+LIKES_BUFFER = {
+    # Per-process journals of buffered likes; must survive restarts.
+    'DIRECTORY': BASE_DIR / 'var' / 'likes',
+    'MAX_PENDING': 1000,
+    'FLUSH_INTERVAL': 2,
+}
+
+STORE_RESPONSE_CACHE = {
+    'TIMEOUT': 60,
+    'MAX_ENTRIES': 1000,
+}
+
 JWT_COOKIE_NAME = 'access_token'
 JWT_REFRESH_COOKIE_NAME = 'refresh_token'
 JWT_COOKIE_SECURE = not IS_LOCAL  # Secure only in production
 JWT_COOKIE_HTTP_ONLY = True
 JWT_COOKIE_SAME_SITE = 'Strict'
+JWT_REVOCATION = {
+    'SYNC_INTERVAL': 5,
+    'REBUILD_INTERVAL': 60 * 60,
+    'CAPACITY': 1_000_000,
+    'ERROR_RATE': 0.01,
+}
+JWT_USER_CACHE = {
+    'TIMEOUT': 60,
+    'MAX_ENTRIES': 10000,
+}
 
 CSRF_COOKIE_HTTPONLY = True
 CSRF_COOKIE_SAMESITE = "Strict"
@@ -179,6 +233,10 @@ CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
 ]
+# Response headers the frontend reads; browsers hide the others cross-origin.
+CORS_EXPOSE_HEADERS = [
+    "X-Cart-Total-Price",
+]
 
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Storefront API',
@@ -241,4 +299,13 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,    
 }
 
-AUTH_USER_MODEL = 'core.User'
\ No newline at end of file
+AUTH_USER_MODEL = 'core.User'
+
+AUTHENTICATION_BACKENDS = [
+    'store.backends.CachedModelBackend',
+]
+
+PERMISSION_CACHE = {
+    'TIMEOUT': 300,
+    'MAX_ENTRIES': 10000,
+}
\ No newline at end of file
@@ -0,0 +1,30 @@
+"""
+Local settings with a primary and a read replica on two SQLite files.
+
+SQLite has no replication, so the replica is a copy of the primary:
+
+    python manage.py migrate --settings=storefront.settings_replica
+    cp db.sqlite3 db_replica.sqlite3
+    python manage.py runserver --settings=storefront.settings_replica
+
+Reads on the store endpoints then come from db_replica.sqlite3 and show
+the "replication lag" of the copy, except right after the client writes.
+Without db_replica.sqlite3 reads fall back to the primary.
+"""
+from .settings import *
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    'replica': {
+        # Read-only, and a missing file fails to connect instead of being created.
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{BASE_DIR / "db_replica.sqlite3"}?mode=ro',
+        'OPTIONS': {'uri': True},
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+STORE_DB_REPLICAS = {**STORE_DB_REPLICAS, 'ALIASES': ['replica']}
@@ -18,6 +18,7 @@ from django.urls import path, include
 import debug_toolbar
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
 from rest_framework.permissions import AllowAny
+from store.metrics import metrics_view
 from store.views import CookieTokenObtainPairView, CookieTokenRefreshView, logout_view
 
 class SpectacularAPIViewNoAuth(SpectacularAPIView):
@@ -42,6 +43,7 @@ urlpatterns = [
     path('api/token/', CookieTokenObtainPairView.as_view(), name='login'),
     path('api/token/refresh/', CookieTokenRefreshView.as_view(), name='refresh'),
     path('api/token/logout/', logout_view, name='logout'),
+    path('metrics/', metrics_view, name='metrics'),
 
     path('api/schema/', SpectacularAPIViewNoAuth.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerViewNoAuth.as_view(), name='swagger-ui'),
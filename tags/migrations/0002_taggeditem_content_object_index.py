@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('tags', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='taggeditem',
+            index=models.Index(fields=['content_type', 'object_id'], name='tags_tagged_content_eaa81e_idx'),
+        ),
+    ]
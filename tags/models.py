@@ -14,6 +14,23 @@ class TaggedItemManager(models.Manager):
                 object_id=obj_id
             )
 
+    def get_tags_for_many(self, obj_type, obj_ids):
+        """
+        Returns {object_id: [tag labels]} for every id in `obj_ids` with
+        one query; objects without tags map to an empty list.
+        """
+        content_type = ContentType.objects.get_for_model(obj_type)
+        tags = {obj_id: [] for obj_id in obj_ids}
+        if not tags:
+            return tags
+        rows = TaggedItem.objects \
+            .filter(content_type=content_type, object_id__in=tags) \
+            .order_by('tag__label') \
+            .values_list('object_id', 'tag__label')
+        for obj_id, label in rows:
+            tags[obj_id].append(label)
+        return tags
+
 
 class Tag(models.Model):
     label = models.CharField(max_length=255)
@@ -28,3 +45,8 @@ class TaggedItem(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id']),
+        ]